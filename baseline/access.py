@@ -0,0 +1,110 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from baseline.result import atomic_file
+
+logger = logging.getLogger(__name__)
+
+# the stats decayed under this score are dropped when saving, a single query is dropped after about seven half-lives
+prune_score = 0.01
+
+
+class AccessStat:
+    def __init__(self):
+        self.score = 0.0
+        self.last_access = 0.0
+
+
+class AccessTracker:
+    """
+    Record which (metric, service) the OAP queries. Each query adds one to the score of the pair, and the score
+    halves every `half_life` seconds, so it reflects both the frequency and the recency of the queries.
+    The stats are saved to the file by each calculation and loaded at the start, so a restart keeps the query history.
+    The stats of the pairs not queried for a long time are dropped when saving, so they never grow without bound.
+    """
+
+    def __init__(self, half_life: float = 3600, file_name: Optional[str] = None):
+        self.half_life = half_life
+        self.file_name = file_name
+        self.lock = threading.Lock()
+        self.stats: dict[str, dict[str, AccessStat]] = defaultdict(dict)
+        if file_name is not None:
+            self.load()
+
+    def record(self, service_name: str, metric_names: list[str]):
+        now = time.time()
+        with self.lock:
+            for metric_name in metric_names:
+                stat = self.stats[metric_name].setdefault(service_name, AccessStat())
+                stat.score = self.decay(stat, now) + 1
+                stat.last_access = now
+
+    def service_scores(self, metric_name: str) -> dict[str, float]:
+        now = time.time()
+        with self.lock:
+            return {service: self.decay(stat, now) for service, stat in self.stats.get(metric_name, {}).items()}
+
+    def metric_scores(self) -> dict[str, float]:
+        now = time.time()
+        with self.lock:
+            return {metric: sum(self.decay(stat, now) for stat in services.values())
+                    for metric, services in self.stats.items()}
+
+    def decay(self, stat: AccessStat, now: float) -> float:
+        if stat.score == 0 or self.half_life <= 0:
+            return stat.score
+        return stat.score * 0.5 ** ((now - stat.last_access) / self.half_life)
+
+    def prune(self, now: float):
+        for metric_name in list(self.stats):
+            services = self.stats[metric_name]
+            for service_name in [service for service, stat in services.items()
+                                 if self.decay(stat, now) < prune_score]:
+                del services[service_name]
+            if not services:
+                del self.stats[metric_name]
+
+    def load(self):
+        try:
+            with open(self.file_name, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"loading the query access stats from {self.file_name} failure: {e}")
+            return
+        with self.lock:
+            for metric_name, services in data.items():
+                for service_name, (score, last_access) in services.items():
+                    stat = self.stats[metric_name].setdefault(service_name, AccessStat())
+                    stat.score, stat.last_access = score, last_access
+
+    def save(self):
+        if self.file_name is None:
+            return
+        with self.lock:
+            self.prune(time.time())
+            data = {metric: {service: [stat.score, stat.last_access] for service, stat in services.items()}
+                    for metric, services in self.stats.items()}
+        os.makedirs(os.path.dirname(self.file_name) or '.', exist_ok=True)
+        with atomic_file(self.file_name) as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
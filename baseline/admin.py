@@ -0,0 +1,177 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from prometheus_client import Counter
+
+from baseline.calculate import Calculator
+
+logger = logging.getLogger(__name__)
+
+admin_recompute_count = Counter('admin_recompute_count', 'The number of services recomputed on demand', ['name'])
+
+# the finished jobs kept for querying the status
+max_kept_jobs = 100
+
+
+class RecomputeStatus(Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+
+class RecomputeJob:
+    def __init__(self, targets: dict[str, set[str]]):
+        self.id = uuid.uuid4().hex
+        self.targets = targets
+        self.status = RecomputeStatus.PENDING
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.recomputed: dict[str, list[str]] = {}
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'status': self.status.value,
+            'targets': {meter: sorted(services) for meter, services in self.targets.items()},
+            'recomputed': self.recomputed,
+            'created': self.created,
+            'finished': self.finished,
+            'error': self.error,
+        }
+
+
+class RecomputeQueue:
+    """
+    Recompute the chosen services out of the scheduled calculation, through the same fetch and fit path in the
+    worker pool. The jobs are waited one by one in a dedicated thread, so they are not waiting for the running
+    calculation.
+    """
+
+    def __init__(self, calculator: Calculator):
+        self.calculator = calculator
+        self.jobs: OrderedDict[str, RecomputeJob] = OrderedDict()
+        self.jobs_lock = threading.Lock()
+        self.queue: queue.Queue[RecomputeJob] = queue.Queue()
+        threading.Thread(target=self.run, name='recompute-queue', daemon=True).start()
+
+    def submit(self, targets: dict[str, set[str]]) -> RecomputeJob:
+        unknown = set(targets) - set(self.calculator.fetcher.metric_names())
+        if unknown:
+            raise ValueError(f"unknown metrics: {sorted(unknown)}")
+        job = RecomputeJob(targets)
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > max_kept_jobs:
+                oldest = next(iter(self.jobs.values()))
+                if oldest.status in (RecomputeStatus.PENDING, RecomputeStatus.RUNNING):
+                    break
+                self.jobs.popitem(last=False)
+        self.queue.put(job)
+        logger.info(f"recompute job {job.id} submitted, targets: {job.to_dict()['targets']}")
+        return job
+
+    def get(self, job_id: str) -> Optional[RecomputeJob]:
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            job.status = RecomputeStatus.RUNNING
+            try:
+                self.calculator.fetcher.ready_fetch()
+                for meter, services in job.targets.items():
+                    # only this thread waits for the worker, the calculation and the queries are not blocked
+                    recomputed = set(self.calculator.recompute(meter, services).result().forecast_ends)
+                    job.recomputed[meter] = sorted(recomputed)
+                    admin_recompute_count.labels(meter).inc(len(recomputed))
+                job.status = RecomputeStatus.FINISHED
+            except Exception as e:
+                job.status = RecomputeStatus.FAILED
+                job.error = str(e)
+                logger.error(f"recompute job {job.id} failure: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
+            job.finished = time.time()
+            logger.info(f"recompute job {job.id} {job.status.value}, recomputed: {job.recomputed}")
+
+
+class AdminServer:
+    """
+    Serve the admin operations by HTTP:
+    `POST /recompute` with `{"targets": [{"metric": "...", "service": "..."}]}` enqueues a recompute job and
+    responds its ID, `GET /recompute/{id}` responds the status of the job.
+    """
+
+    def __init__(self, port: int, recompute: RecomputeQueue):
+        self.port = port
+        self.recompute = recompute
+
+    def start(self):
+        recompute = self.recompute
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != '/recompute':
+                    self.send_error(404)
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                    targets: dict[str, set[str]] = {}
+                    for target in body['targets']:
+                        targets.setdefault(target['metric'], set()).add(target['service'])
+                    if not targets:
+                        raise ValueError("no targets")
+                    job = recompute.submit(targets)
+                except (ValueError, KeyError, TypeError) as e:
+                    self.respond(400, {'error': f"invalid recompute request: {e}"})
+                    return
+                self.respond(202, job.to_dict())
+
+            def do_GET(self):
+                if not self.path.startswith('/recompute/'):
+                    self.send_error(404)
+                    return
+                job = recompute.get(self.path[len('/recompute/'):])
+                if job is None:
+                    self.respond(404, {'error': 'job not found'})
+                    return
+                self.respond(200, job.to_dict())
+
+            def respond(self, code: int, content: dict):
+                body = json.dumps(content).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer(('', self.port), Handler)
+        threading.Thread(target=server.serve_forever, name='admin-server', daemon=True).start()
+        logger.info(f"Admin server started at :{self.port}")
@@ -12,50 +12,400 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import copy
 import logging
+import multiprocessing
+import os
+import threading
+import time
 import traceback
-from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Container, Optional
 
+import pandas as pd
+from prometheus_client import Counter, Summary
+
+from baseline.access import AccessTracker
+from baseline.engine import preload_modules, warm_up_worker
 from baseline.fetcher import Fetcher
-from baseline.predict import PredictService, PredictConfig
-from baseline.result import ResultManager
+from baseline.lease import Coordinator, WorkUnit
+from baseline.memory import current_rss
+from baseline.predict import PredictService, PredictConfig, PredictMeterResult, PredictBatchResult, PredictStats, \
+    frequency_delta
+from baseline.result import ResultManager, StreamingResultWriter, is_retained
 
 log = logging.getLogger(__name__)
 
+calculate_cycle_time = Summary('calculate_cycle_time', 'The time spent on a whole baseline calculation')
+calculate_skipped_cycle_count = Counter('calculate_skipped_cycle_count',
+                                        'The number of calculations skipped because the previous one is still running')
+calculate_carry_over_count = Counter('calculate_carry_over_count',
+                                     'The number of metrics or services carried over to the next calculation', ['name'])
+calculate_worker_recycle_count = Counter('calculate_worker_recycle_count',
+                                         'The number of times the calculation worker pool recycled')
+
+# the minimum query score of the hot services, a single query decays to it after a half-life
+hot_service_score = 0.5
+
+
+class WorkerConfig:
+    def __init__(self, max_workers: int = 0, max_tasks: int = 0, max_memory: int = 0, memory_limit_ratio: float = 0,
+                 rss_growth_tasks: int = 0):
+        self.max_workers = max_workers
+        self.max_tasks = max_tasks
+        # the maximum RSS of a worker in MB
+        self.max_memory = max_memory
+        # only fit while the used memory of the container is under this ratio of its limit
+        self.memory_limit_ratio = memory_limit_ratio
+        # recycle the workers when the RSS of a worker keeps growing in this number of tasks
+        self.rss_growth_tasks = rss_growth_tasks
+
 
 class Calculator:
 
-    def __init__(self, conf: PredictConfig, fetcher: Fetcher, saver: ResultManager):
+    def __init__(self, conf: PredictConfig, fetcher: Fetcher, saver: ResultManager,
+                 access_tracker: Optional[AccessTracker] = None, worker: Optional[WorkerConfig] = None,
+                 coordinator: Optional[Coordinator] = None):
         self.conf = conf
         self.fetcher = fetcher
         self.saver = saver
+        self.access_tracker = access_tracker
+        self.worker = worker or WorkerConfig()
+        # partition the work with the other replicas, None means calculating all metrics by this replica
+        self.coordinator = coordinator
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # the pool is shared by the calculation, the correction and the admin recompute threads
+        self.executor_lock = threading.Lock()
+        self.worker_rss: dict[int, list[int]] = {}
+        # the timestamp in seconds of the last finished calculation
+        self.last_finished: Optional[float] = None
+        # the fetching and fitting statistics of the last calculation
+        self.stats = PredictStats()
+        self.last_calculated: dict[str, float] = {}
+        self.forecast_ends: dict[str, dict[str, pd.Timestamp]] = {}
+        self.running = threading.Lock()
+        # the metrics with the services not finished before the deadline, empty set means the whole metric
+        self.carry_over: dict[str, set[str]] = {}
 
-    def start(self):
-        futures = {}
-        with ProcessPoolExecutor() as executor:
-            metric_names = self.fetcher.metric_names()
-            if not metric_names:
-                log.error("No metric names found")
+    def start(self, deadline: Optional[float] = None, cycle: Optional[str] = None):
+        """
+        Calculate the baseline of all metrics. When the deadline(timestamp in seconds) reached, the not started
+        metrics and services are carried over to the next calculation, and calculated first at that time.
+        The cycle identifies the execution shared by all replicas, the units completed by any replica in the same
+        cycle are not calculated again.
+        """
+        if not self.running.acquire(blocking=False):
+            log.warning("The previous baseline calculation is still running, skip this one")
+            calculate_skipped_cycle_count.inc()
+            return
+        try:
+            with calculate_cycle_time.time():
+                self.start0(deadline, cycle)
+            self.last_finished = time.time()
+        finally:
+            self.running.release()
+
+    def worker_pool(self) -> ProcessPoolExecutor:
+        """
+        The long-lived worker pool shared by all calculations. The workers are forked from the fork server which
+        preloaded the heavy modules, and recycled after the max tasks or when exceeding the max memory.
+        """
+        with self.executor_lock:
+            if self.executor is None:
+                ctx = multiprocessing.get_context('forkserver')
+                ctx.set_forkserver_preload(preload_modules)
+                root = logging.getLogger()
+                self.executor = ProcessPoolExecutor(max_workers=self.worker.max_workers or None, mp_context=ctx,
+                                                    initializer=warm_up_worker,
+                                                    initargs=(root.level, root.handlers[0].formatter if root.handlers else None),
+                                                    max_tasks_per_child=self.worker.max_tasks or None)
+            return self.executor
+
+    def recycle_worker_pool(self, reason: str):
+        with self.executor_lock:
+            if self.executor is None:
                 return
+            log.warning(f"Recycle the calculation worker pool: {reason}")
+            calculate_worker_recycle_count.inc()
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+            self.worker_rss.clear()
+
+    def close(self):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+
+    def start0(self, deadline: Optional[float], cycle: Optional[str]):
+        skipped: dict[str, set[str]] = {}
+        broken = False
+        metric_names = self.fetcher.metric_names()
+        if not metric_names:
+            log.error("No metric names found")
+            return
+        try:
+            self.fetcher.ready_fetch()
+        except Exception as e:
+            log.error(f"Ready to fetch data failure, skip calculate predict: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
+            return
+        executor = self.worker_pool()
+        cycle = cycle or str(time.time())
+        self.stats = PredictStats()
+        if self.access_tracker is not None:
             try:
-                self.fetcher.ready_fetch()
-            except Exception as e:
-                log.error(f"Ready to fetch data failure, skip calculate predict: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
-                return
-            for inx in range(len(metric_names)):
-                meter = metric_names[inx]
-                log.info("Calculating baseline for %s" % meter)
-
-                future = executor.submit(PredictService(self.fetcher, meter, self.conf).predict)
-                futures[future] = meter
-
-            while futures:
-                done, remaining_futures = wait(futures.keys(), return_when=FIRST_COMPLETED)
-                for future in done:
-                    try:
-                        result = future.result()
-                        meter = futures[future]
-                        self.saver.save(meter, result)
-                    except Exception as e:
-                        log.error(f"Calculate or saving metrics failure: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
-                futures = {future: futures[future] for future in remaining_futures}
\ No newline at end of file
+                self.access_tracker.save()
+            except OSError as e:
+                log.warning(f"saving the query access stats failure: {e}")
+        # the carried over metrics first, then the most queried metrics
+        metric_scores = self.access_tracker.metric_scores() if self.access_tracker is not None else {}
+        metric_names = sorted(metric_names, key=lambda name: (name not in self.carry_over, -metric_scores.get(name, 0)))
+        services: dict[str, PredictService] = {}
+        units: list[WorkUnit] = []
+        for inx in range(len(metric_names)):
+            meter = metric_names[inx]
+            conf = self.conf.for_metric(meter)
+            if meter not in self.carry_over and not self.need_recompute(meter, conf):
+                log.info("Skip calculating baseline for %s, recomputed in the last %d minutes" %
+                         (meter, conf.recompute_interval))
+                continue
+            priorities = self.access_tracker.service_scores(meter) if self.access_tracker is not None else {}
+            for service in self.carry_over.get(meter, set()):
+                priorities[service] = float('inf')
+            skipped[meter] = self.fresh_services(meter, conf, priorities) | self.lazy_services(meter, conf, priorities)
+            log.info("Calculating baseline for %s, keep the existing baseline of %d services" % (meter, len(skipped[meter])))
+
+            services[meter] = PredictService(self.fetcher, meter, conf, skipped[meter], priorities, deadline=deadline,
+                                             memory_limit_ratio=self.worker.memory_limit_ratio)
+            if self.coordinator is None:
+                units.append(WorkUnit(meter, 0))
+            else:
+                units.extend(self.coordinator.units(meter, self.fetcher.service_names()))
+
+        futures: dict[Future, WorkUnit] = {}
+        pending = units
+        unfinished: dict[str, set[str]] = {}
+        cancelled: set[str] = set()
+        deadline_reached = False
+        while futures or pending:
+            pending = self.submit_units(executor, pending, futures, services, skipped, cycle)
+            if not deadline_reached and deadline is not None and time.time() >= deadline:
+                deadline_reached = True
+                for future in list(futures):
+                    if future.cancel():
+                        cancelled.add(self.cancel_unit(futures.pop(future)))
+                for unit in pending:
+                    log.warning(f"Calculating baseline for {unit.name} not claimed before the deadline")
+                pending = []
+            if not futures:
+                if pending:
+                    # the units held by the other replicas, wait to take over them when their leases expired
+                    time.sleep(self.coordinator.renew_interval)
+                continue
+
+            timeout = None
+            if self.coordinator is not None:
+                timeout = self.coordinator.renew_interval
+            if not deadline_reached and deadline is not None:
+                timeout = min(timeout or float('inf'), max(deadline - time.time(), 0))
+            done, remaining_futures = wait(futures.keys(), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit = futures[future]
+                meter = unit.meter
+                try:
+                    batch, pid, rss = future.result()
+                    self.track_worker_rss(pid, rss)
+                    self.stats.merge(batch.stats)
+                    self.update_forecast_ends(meter, batch, skipped[meter] | set(batch.unfinished),
+                                              self.unit_scope(unit))
+                    self.last_calculated[meter] = time.time()
+                    self.saver.refresh(meter)
+                    unfinished.setdefault(meter, set()).update(batch.unfinished)
+                    if self.coordinator is not None:
+                        self.coordinator.leases.complete(unit.name, cycle)
+                except BrokenProcessPool as e:
+                    broken = True
+                    log.error(f"Calculate metrics {unit.name} failure, the worker terminated abruptly, "
+                              f"carry over to next time: {e}")
+                    cancelled.add(self.cancel_unit(unit))
+                except Exception as e:
+                    log.error(f"Calculate or saving metrics failure: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
+                    if self.coordinator is not None:
+                        self.coordinator.leases.release(unit.name)
+            futures = {future: futures[future] for future in remaining_futures}
+            if self.coordinator is not None:
+                for unit in futures.values():
+                    if not self.coordinator.leases.renew(unit.name):
+                        log.warning(f"The lease of {unit.name} is lost, it might be calculated by another replica")
+
+        for meter, services_unfinished in unfinished.items():
+            if meter in cancelled:
+                continue
+            self.carry_over.pop(meter, None)
+            if services_unfinished:
+                self.carry_over[meter] = services_unfinished
+                calculate_carry_over_count.labels(meter).inc(len(services_unfinished))
+
+        if broken:
+            self.recycle_worker_pool("the worker pool is broken")
+            return
+        reason = self.worker_recycle_reason()
+        if reason is not None:
+            self.recycle_worker_pool(reason)
+
+    def submit_units(self, executor: ProcessPoolExecutor, units: list[WorkUnit], futures: dict[Future, WorkUnit],
+                     services: dict[str, PredictService], skipped: dict[str, set[str]], cycle: str) -> list[WorkUnit]:
+        """
+        Submit the units could be calculated by this replica, returns the units held by the other replicas.
+        """
+        pending = []
+        for unit in units:
+            if self.coordinator is not None and not self.coordinator.leases.acquire(unit.name, cycle):
+                if not self.coordinator.leases.is_completed(unit.name, cycle):
+                    pending.append(unit)
+                continue
+            service = services[unit.meter]
+            if unit.services is not None:
+                service = copy.copy(service)
+                service.services = unit.services
+            futures[executor.submit(predict_and_save, service, self.saver, skipped[unit.meter],
+                                    self.unit_scope(unit))] = unit
+        return pending
+
+    def unit_scope(self, unit: WorkUnit) -> Optional[Container[str]]:
+        # the stored baseline of the services of the other units, and the not selected services are kept
+        selected = self.fetcher.selected_services()
+        if selected is None:
+            return unit if unit.services is not None else None
+        return SelectedScope(unit, selected)
+
+    def cancel_unit(self, unit: WorkUnit) -> str:
+        log.warning(f"Calculating baseline for {unit.name} not started before the deadline, carry over to next time")
+        self.carry_over[unit.meter] = set()
+        calculate_carry_over_count.labels(unit.meter).inc()
+        if self.coordinator is not None:
+            self.coordinator.leases.release(unit.name)
+        return unit.meter
+
+    def track_worker_rss(self, pid: int, rss: int):
+        history = self.worker_rss.setdefault(pid, [])
+        history.append(rss)
+        del history[:-(self.worker.rss_growth_tasks + 1)]
+
+    def worker_recycle_reason(self) -> Optional[str]:
+        for pid, history in self.worker_rss.items():
+            if self.worker.max_memory > 0 and history[-1] > self.worker.max_memory * 1024 * 1024:
+                return f"the worker({pid}) RSS {history[-1] / 1024 / 1024:.1f}MB exceeds {self.worker.max_memory}MB"
+            if (self.worker.rss_growth_tasks > 0 and len(history) > self.worker.rss_growth_tasks and
+                    all(prev < cur for prev, cur in zip(history, history[1:]))):
+                return (f"the worker({pid}) RSS keeps growing in the last {self.worker.rss_growth_tasks} tasks, "
+                        f"current: {history[-1] / 1024 / 1024:.1f}MB")
+        return None
+
+    def recompute(self, meter: str, services: set[str]) -> "Future[PredictBatchResult]":
+        """
+        Queue the given services to be recomputed in the worker pool out of the cycle, the worker merges them into
+        the stored results. The returned future is resolved with the summary after the results saved.
+        """
+        service = PredictService(self.fetcher, meter, self.conf.for_metric(meter), services=services)
+        recomputed: Future[PredictBatchResult] = Future()
+
+        def saved(future: Future):
+            try:
+                batch, pid, rss = future.result()
+                self.saver.refresh(meter)
+                self.update_forecast_ends(meter, batch)
+                recomputed.set_result(batch)
+            except BaseException as e:
+                log.error(f"Recompute {len(services)} services of {meter} failure: {e}")
+                recomputed.set_exception(e)
+
+        # the empty scope keeps the stored baseline of all services not recomputed
+        self.worker_pool().submit(predict_and_save, service, self.saver, set(), set()).add_done_callback(saved)
+        return recomputed
+
+    def need_recompute(self, meter: str, conf: PredictConfig) -> bool:
+        if conf.recompute_interval <= 0 or meter not in self.last_calculated:
+            return True
+        return time.time() - self.last_calculated[meter] >= conf.recompute_interval * 60
+
+    def fresh_services(self, meter: str, conf: PredictConfig, priorities: Optional[dict[str, float]] = None) -> set[str]:
+        if conf.refresh_horizon <= 0:
+            return set()
+        now = pd.Timestamp.now()
+        refresh_before = now + frequency_delta(conf.frequency, conf.refresh_horizon)
+        # the hot services are recalculated while more predicted points remaining, so they are refreshed more often
+        hot_refresh_before = now + frequency_delta(conf.frequency, max(conf.hot_refresh_horizon, conf.refresh_horizon))
+        priorities = priorities or {}
+        return {service for service, end in self.tracked_forecast_ends(meter).items()
+                if end >= (hot_refresh_before if priorities.get(service, 0) >= hot_service_score else refresh_before)}
+
+    def tracked_forecast_ends(self, meter: str) -> dict[str, pd.Timestamp]:
+        if meter not in self.forecast_ends:
+            self.track_forecast_ends(meter, self.saver.load(meter))
+        return self.forecast_ends[meter]
+
+    def lazy_services(self, meter: str, conf: PredictConfig, priorities: dict[str, float]) -> set[str]:
+        # the never queried services keep their stored baseline, the new ones are skipped by the PredictService
+        if not conf.lazy_unqueried or not priorities:
+            return set()
+        return {service for service in self.tracked_forecast_ends(meter) if service not in priorities}
+
+    def update_forecast_ends(self, meter: str, batch: PredictBatchResult, retain: Optional[set[str]] = None,
+                             scope: Optional[Container[str]] = None):
+        ends = self.forecast_ends.get(meter, {})
+        if retain is not None:
+            ends = {service: end for service, end in ends.items() if is_retained(service, retain, scope)}
+        ends.update(batch.forecast_ends)
+        self.forecast_ends[meter] = ends
+
+    def track_forecast_ends(self, meter: str, results: list[PredictMeterResult]):
+        ends: dict[str, pd.Timestamp] = {}
+        for result in results:
+            end = result.max_timestamp()
+            if end is not None:
+                ends[result.service_name] = end
+        self.forecast_ends[meter] = ends
+
+
+class SelectedScope:
+    """
+    The services of the unit which are also selected by the fetcher.
+    """
+
+    def __init__(self, unit: WorkUnit, selected: set[str]):
+        self.unit = unit
+        self.selected = selected
+
+    def __contains__(self, service: str) -> bool:
+        return service in self.selected and service in self.unit
+
+
+def predict_and_save(service: PredictService, saver: ResultManager, retain: set[str],
+                     scope: Optional[Container[str]] = None) -> tuple[PredictBatchResult, int, int]:
+    batch = predict_and_save0(service, saver, retain, scope)
+    return batch, os.getpid(), current_rss()
+
+
+def predict_and_save0(service: PredictService, saver: ResultManager, retain: set[str],
+                      scope: Optional[Container[str]] = None) -> PredictBatchResult:
+    """
+    Run in the worker process: predict the metric and save the results directly, only the summary is sent back to
+    the parent. The stored baseline of the services in the retain, the unfinished services and the services out of
+    the scope are kept. The results are saved while calculating when the save queue size is configured.
+    """
+    if service.conf.save_queue_size <= 0 or not saver.incremental_update:
+        batch = service.predict()
+        saver.update(service.name, batch.results, retain | set(batch.unfinished), scope)
+        return batch.without_results()
+
+    writer = StreamingResultWriter(saver, service.name, service.conf.save_queue_size)
+    service.result_handler = writer.put
+    try:
+        batch = service.predict()
+    finally:
+        writer.close()
+    # remove the stored baseline of the services no longer existing
+    saver.update(service.name, [], retain | set(batch.unfinished) | set(batch.forecast_ends), scope)
+    return batch.without_results()
@@ -0,0 +1,111 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+from typing import Any, Callable, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterConfig:
+    def __init__(self, enabled: bool = False, distance: float = 0.1, max_error: float = 0.2):
+        self.enabled = enabled
+        self.distance = distance
+        self.max_error = max_error
+
+
+class ClusterMember:
+    """
+    A single series (one service, or one label of a service) in a cluster. The series is normalized by
+    its mean value, so members that share the daily shape but differ in scale end up together.
+    """
+
+    def __init__(self, key: Hashable, df: pd.DataFrame, scale: float, profile: np.ndarray):
+        self.key = key
+        self.df = df
+        self.scale = scale
+        self.profile = profile
+
+    def normalized(self) -> pd.DataFrame:
+        return pd.DataFrame({'ds': self.df['ds'], 'y': self.df['y'] / self.scale})
+
+
+class SeriesCluster:
+    def __init__(self, centroid: np.ndarray):
+        self.centroid = centroid
+        self.members: list[ClusterMember] = []
+
+    def training_df(self) -> pd.DataFrame:
+        df = pd.concat([member.normalized() for member in self.members], ignore_index=True)
+        return df.groupby('ds', as_index=False)['y'].mean()
+
+    def member_error(self, member: ClusterMember, forecast: pd.DataFrame) -> float:
+        merged = member.normalized().merge(forecast[['ds', 'yhat']], on='ds', how='inner')
+        if len(merged) == 0:
+            return float('inf')
+        return float((merged['y'] - merged['yhat']).abs().mean())
+
+    def member_forecast(self, member: ClusterMember, forecast: pd.DataFrame, error: float) -> pd.DataFrame:
+        """
+        Rescale the shared forecast to the member. The band of the shared model is fitted on the averaged series,
+        which is smoother than the members, so the band is widened by the normalized error of the member.
+        """
+        scaled = forecast.loc[forecast['ds'] >= member.df['ds'].max(), ['ds', 'yhat', 'yhat_lower', 'yhat_upper']].copy()
+        scaled['yhat_lower'] = scaled['yhat_lower'] - error
+        scaled['yhat_upper'] = scaled['yhat_upper'] + error
+        for column in ('yhat', 'yhat_lower', 'yhat_upper'):
+            scaled[column] = scaled[column] * member.scale
+        return scaled
+
+
+def seasonal_profile(df: pd.DataFrame) -> Optional[tuple[float, np.ndarray]]:
+    scale = float(df['y'].mean())
+    if not np.isfinite(scale) or scale <= 0:
+        return None
+    profile = df.groupby(df['ds'].dt.hour)['y'].mean().reindex(range(24)).to_numpy() / scale
+    if np.isnan(profile).any():
+        return None
+    return scale, profile
+
+
+def build_clusters(series: dict[Hashable, pd.DataFrame], conf: ClusterConfig,
+                   sort_key: Optional[Callable[[Hashable], Any]] = None) -> tuple[list[SeriesCluster], list[Hashable]]:
+    """
+    Group the series by their normalized daily profile. Returns the clusters and the keys of the series
+    which cannot be normalized (such as all-zero series), these should be fitted individually.
+    The series are grouped in the order of the sort key (the key itself by default), a series joins the first
+    matched cluster, so the clusters are the same no matter in which order the services are fetched.
+    """
+    clusters: list[SeriesCluster] = []
+    standalone: list[Hashable] = []
+    for key in sorted(series, key=sort_key):
+        df = series[key]
+        profile = seasonal_profile(df)
+        if profile is None:
+            standalone.append(key)
+            continue
+        scale, shape = profile
+        member = ClusterMember(key, df, scale, shape)
+        for cluster in clusters:
+            if np.abs(cluster.centroid - shape).max() <= conf.distance:
+                cluster.members.append(member)
+                break
+        else:
+            cluster = SeriesCluster(shape)
+            cluster.members.append(member)
+            clusters.append(cluster)
+    return clusters, standalone
@@ -0,0 +1,237 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictValue, \
+    PredictLabeledWithLabeledValue, LabelKeyValue, nanos_to_time_buckets
+from baseline.result import ResultManager, QueryTimeBucketStep, time_bucket_to_nanos, file_lock, \
+    atomic_file, remove_stale_temp_files
+
+log = logging.getLogger(__name__)
+
+magic = b'SKPC'
+# magic, version, the length of the index
+header = struct.Struct('<4sIQ')
+version = 1
+# the label ID of the single value rows
+single_label = -1
+# the old generations are kept for the readers still mapping them
+generation_grace_seconds = 60
+
+
+class ColumnarGeneration:
+    """
+    A generation of the results of a metric, the rows of each service are stored continuously in the columns, ordered
+    by the label and the timestamp. The index maps the service name to its rows, so a query only touches the rows of
+    the service.
+    """
+
+    def __init__(self, file_name: str):
+        with open(file_name, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, index_length = header.unpack_from(self.mmap, 0)
+        if file_magic != magic or file_version != version:
+            raise ValueError(f"unsupported columnar result file: {file_name}")
+        index = json.loads(self.mmap[header.size:header.size + index_length])
+        self.services: dict[str, list] = index['services']
+        self.labels = [frozenset(LabelKeyValue(k, v) for k, v in label) for label in index['labels']]
+        rows = index['rows']
+        offset = aligned(header.size + index_length)
+        self.timestamps = np.frombuffer(self.mmap, dtype=np.int64, count=rows, offset=offset)
+        offset += rows * 8
+        self.values = np.frombuffer(self.mmap, dtype=np.float64, count=rows * 3, offset=offset).reshape(3, rows)
+        offset += rows * 8 * 3
+        self.label_ids = np.frombuffer(self.mmap, dtype=np.int32, count=rows, offset=offset)
+
+    def result(self, service_name: str, start: Optional[int] = None,
+               end: Optional[int] = None) -> Optional[PredictMeterResult]:
+        entry = self.services.get(service_name)
+        if entry is None:
+            return None
+        first, last, has_single, has_labeled = entry
+        label_ids = self.label_ids[first:last]
+        # the label groups of the service, the single value rows are the first
+        group_ids, group_starts = np.unique(label_ids, return_index=True)
+        group_ends = list(group_starts[1:]) + [len(label_ids)]
+        single, labeled = ([] if has_single else None), ([] if has_labeled else None)
+        for label_id, group_start, group_end in zip(group_ids, group_starts, group_ends):
+            group_start, group_end = first + int(group_start), first + int(group_end)
+            timestamps = self.timestamps[group_start:group_end]
+            if end is not None:
+                group_end = group_start + int(np.searchsorted(timestamps, end, side='right'))
+            if start is not None:
+                group_start += int(np.searchsorted(timestamps, start, side='left'))
+            values = self.point_values(group_start, group_end)
+            if label_id == single_label:
+                single = values
+            else:
+                labeled.append(PredictLabeledWithLabeledValue(self.labels[label_id], values))
+        return PredictMeterResult(service_name, single, labeled)
+
+    def point_values(self, start: int, end: int) -> list[PredictTimestampWithSingleValue]:
+        values = self.values[:, start:end]
+        timestamps = self.timestamps[start:end]
+        return [PredictTimestampWithSingleValue(ts, PredictValue(value, upper, lower), bucket)
+                for ts, bucket, value, upper, lower in zip(timestamps.tolist(),
+                                                           nanos_to_time_buckets(timestamps).tolist(),
+                                                           values[0].tolist(), values[1].tolist(), values[2].tolist())]
+
+
+class ColumnarResultManager(ResultManager):
+    """
+    Store the results of each metric as columns in a binary file, which is memory mapped by the readers. Each saving
+    writes a new generation file, then switches the pointer file of the metric to it atomically, so the readers always
+    see a complete generation without locking.
+    """
+
+    # nothing is parsed, the queries mostly wait for the page faults of the mapped files
+    query_concurrency = 8
+
+    def __init__(self, dir: str):
+        self.dir = dir
+        self.generations: dict[str, tuple[tuple[int, int], ColumnarGeneration]] = {}
+        self.mutex = threading.Lock()
+
+    def __getstate__(self):
+        return {'dir': self.dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['dir'])
+
+    def save(self, meter_name: str, results: list[PredictMeterResult]):
+        os.makedirs(self.dir, exist_ok=True)
+        generation = f"{meter_name}.{time.time_ns()}-{os.getpid()}.bin"
+        write_generation(f"{self.dir}/{generation}", results)
+        with atomic_file(self.pointer_file(meter_name)) as f:
+            f.write(generation)
+        self.remove_old_generations(meter_name, generation)
+        remove_stale_temp_files(self.dir, meter_name)
+
+    def query(self, service_name: str, metrics_names: list[str], start_bucket: int, end_bucket: int,
+              step: QueryTimeBucketStep) -> dict[str, list[PredictMeterResult]]:
+        results: dict[str, list[PredictMeterResult]] = {}
+        start = time_bucket_to_nanos(start_bucket, step)
+        end = time_bucket_to_nanos(end_bucket, step)
+        for meter_name in metrics_names:
+            generation = self.generation(meter_name)
+            if generation is None:
+                log.info(f"cannot found the baseline result of {meter_name}")
+                continue
+            result = generation.result(service_name, start, end)
+            if result is not None:
+                results[meter_name] = [result]
+        return results
+
+    def load(self, meter_name: str) -> list[PredictMeterResult]:
+        generation = self.generation(meter_name)
+        if generation is None:
+            return []
+        return [generation.result(service_name) for service_name in generation.services]
+
+    def updated_time(self, meter_name: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.pointer_file(meter_name))
+        except OSError:
+            return None
+
+    def lock(self, meter_name: str):
+        return file_lock(self.dir, meter_name)
+
+    def pointer_file(self, meter_name: str) -> str:
+        return f"{self.dir}/{meter_name}.columnar"
+
+    def generation(self, meter_name: str) -> Optional[ColumnarGeneration]:
+        pointer = self.pointer_file(meter_name)
+        try:
+            stat = os.stat(pointer)
+        except FileNotFoundError:
+            return None
+        # the pointer file is replaced by each saving, so its inode identifies the generation
+        version_key = (stat.st_ino, stat.st_mtime_ns)
+        with self.mutex:
+            cached = self.generations.get(meter_name)
+            if cached is not None and cached[0] == version_key:
+                return cached[1]
+        try:
+            with open(pointer, 'r', encoding='utf-8') as f:
+                generation = ColumnarGeneration(f"{self.dir}/{f.read().strip()}")
+        except (OSError, ValueError) as e:
+            log.error(f"reading the baseline result of {meter_name} failure: {e}")
+            return None
+        with self.mutex:
+            self.generations[meter_name] = (version_key, generation)
+        return generation
+
+    def remove_old_generations(self, meter_name: str, current: str):
+        pattern = re.compile(rf"{re.escape(meter_name)}\.\d+-\d+\.bin")
+        expired = time.time() - generation_grace_seconds
+        for entry in os.scandir(self.dir):
+            if entry.name == current or not pattern.fullmatch(entry.name):
+                continue
+            try:
+                if entry.stat().st_mtime < expired:
+                    os.remove(entry.path)
+            except OSError as e:
+                log.warning(f"removing the old baseline result {entry.name} failure: {e}")
+
+
+def write_generation(file_name: str, results: list[PredictMeterResult]):
+    label_ids: dict[frozenset[LabelKeyValue], int] = {}
+    services: dict[str, list] = {}
+    timestamps, values, rows_labels = [], [], []
+    for result in results:
+        first = len(timestamps)
+        groups = [(single_label, result.single or [])]
+        for labeled in result.labeled or []:
+            groups.append((label_ids.setdefault(labeled.label, len(label_ids)), labeled.time_with_values))
+        for label_id, points in sorted(groups, key=lambda group: group[0]):
+            for point in sorted(points, key=lambda p: p.timestamp):
+                timestamps.append(pd.Timestamp(point.timestamp).value)
+                values.append((point.value.value, point.value.upper_value, point.value.lower_value))
+                rows_labels.append(label_id)
+        services[result.service_name] = [first, len(timestamps), result.single is not None,
+                                         result.labeled is not None]
+
+    labels = sorted(label_ids, key=label_ids.get)
+    index = json.dumps({
+        'rows': len(timestamps),
+        'services': services,
+        'labels': [sorted([label.key, label.value] for label in label_set) for label_set in labels],
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    columns = np.array(values, dtype=np.float64).reshape(-1, 3).T
+    with open(file_name, 'wb') as f:
+        f.write(header.pack(magic, version, len(index)))
+        f.write(index)
+        f.write(b'\0' * (aligned(header.size + len(index)) - header.size - len(index)))
+        f.write(np.array(timestamps, dtype=np.int64).tobytes())
+        f.write(np.ascontiguousarray(columns).tobytes())
+        f.write(np.array(rows_labels, dtype=np.int32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def aligned(offset: int) -> int:
+    return (offset + 7) // 8 * 8
@@ -36,11 +36,26 @@ class MonitorConfig(BaseModel):
 
 class GRPCConfig(BaseModel):
     port: int = 18080
+    prediction_cache_size: int = 10000
+    query_concurrency: int = 0
+
+
+class ReadinessConfig(BaseModel):
+    enabled: bool = False
+    port: int = 8001
+    max_age: int = 0
+
+
+class AdminConfig(BaseModel):
+    enabled: bool = False
+    port: int = 8002
 
 
 class ServerConfig(BaseModel):
     grpc: GRPCConfig
     monitor: MonitorConfig
+    readiness: ReadinessConfig = ReadinessConfig()
+    admin: AdminConfig = AdminConfig()
 
 
 class BaselineFetchMetricsTagMappingConfig(BaseModel):
@@ -52,10 +67,23 @@ class BaselineFetchValuePreProcessConfig(BaseModel):
     hour_to_minute: bool = False
 
 
+class BaselineMetricPredictConfig(BaseModel):
+    engine: Optional[str] = None
+    min_days: Optional[int] = None
+    window_days: Optional[int] = None
+    frequency: Optional[str] = None
+    period: Optional[int] = None
+    interval_width: Optional[float] = None
+    recompute_interval: Optional[int] = None
+    refresh_horizon: Optional[int] = None
+    hot_refresh_horizon: Optional[int] = None
+
+
 class BaselineFetchMetricsConfig(BaseModel):
     name: str
-    enabled: bool
+    enabled: bool = True
     pre_process: Optional[BaselineFetchValuePreProcessConfig] = None
+    predict: Optional[BaselineMetricPredictConfig] = None
 
 
 class BaselineFetchGraphqlServerConfig(BaseModel):
@@ -75,27 +103,86 @@ class BaselineFetchGraphqlServerConfig(BaseModel):
 
 class BaselineFetchConfig(BaseModel):
     server: BaselineFetchGraphqlServerConfig
-    metrics: List[str]
+    metrics: List[BaselineFetchMetricsConfig]
 
     @model_validator(mode="before")
     @classmethod
     def convert_layers(cls, values):
         if isinstance(values.get("metrics"), str):
             values["metrics"] = [metrics.strip() for metrics in values["metrics"].split(",")]
+        if isinstance(values.get("metrics"), list):
+            values["metrics"] = [{"name": metrics} if isinstance(metrics, str) else metrics
+                                 for metrics in values["metrics"]]
         return values
 
+    def enabled_metric_names(self) -> List[str]:
+        return [metrics.name for metrics in self.metrics if metrics.enabled]
+
+
+class BaselinePredictClusterConfig(BaseModel):
+    enabled: bool = False
+    distance: float = 0.1
+    max_error: float = 0.2
+
+
+class BaselinePredictPipelineConfig(BaseModel):
+    enabled: bool = False
+    fetch_concurrency: int = 4
+    fit_concurrency: int = 0
+    queue_size: int = 16
+
+
+class BaselinePredictWorkerConfig(BaseModel):
+    max_workers: int = 0
+    max_tasks: int = 0
+    max_memory: int = 0
+    memory_limit_ratio: float = 0
+    rss_growth_tasks: int = 0
+
 
 class BaselinePredictConfig(BaseModel):
     directory: str = "/tmp"
+    storage: str = 'json'
     min_days: int = 3
     frequency: str = 'h'
     period: int = 24
+    engine: str = 'prophet'
+    window_days: int = 0
+    interval_width: float = 0.8
+    recompute_interval: int = 0
+    refresh_horizon: int = 0
+    hot_refresh_horizon: int = 0
+    lazy_unqueried: bool = False
+    query_half_life: int = 60
+    fit_timeout: float = 0
+    save_queue_size: int = 0
+    cache_size: int = 256
+    cluster: BaselinePredictClusterConfig = BaselinePredictClusterConfig()
+    pipeline: BaselinePredictPipelineConfig = BaselinePredictPipelineConfig()
+    worker: BaselinePredictWorkerConfig = BaselinePredictWorkerConfig()
+
+
+class BaselineCorrectionConfig(BaseModel):
+    interval: int = 0
+    lookback: int = 3
+    alpha: float = 0.5
+    drift_threshold: float = 0
+    refit_cooldown: int = 60
+
+
+class BaselineCoordinationConfig(BaseModel):
+    enabled: bool = False
+    directory: str = "/tmp/lease"
+    shards: int = 1
+    lease_ttl: int = 60
 
 
 class BaselineConfig(BaseModel):
     cron: str = "0 0 * * *"
     fetch: BaselineFetchConfig
     predict: BaselinePredictConfig
+    correction: BaselineCorrectionConfig = BaselineCorrectionConfig()
+    coordination: BaselineCoordinationConfig = BaselineCoordinationConfig()
 
 
 def parse_env_variables(value):
@@ -0,0 +1,219 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import copy
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import Optional
+
+import pandas as pd
+from prometheus_client import Counter, Summary
+
+from baseline.calculate import Calculator
+from baseline.fetcher import FetchedData, LabelKeyValue
+from baseline.predict import PredictTimestampWithSingleValue, PredictMeterResult, compact_series_frame
+
+logger = logging.getLogger(__name__)
+
+correct_metrics_time = Summary('correct_metrics_time', 'The time spent on correcting the predicted metrics', ['name'])
+correct_series_count = Counter('correct_series_count', 'The number of corrected series', ['name'])
+correct_drift_refit_count = Counter('correct_drift_refit_count',
+                                    'The number of services recomputed because of drifting out of the baseline', ['name'])
+
+# the level smaller than it is the rounding error of the values already corrected
+correction_epsilon = 1e-6
+
+
+class CorrectionConfig:
+    def __init__(self, interval: int = 0, lookback: int = 3, alpha: float = 0.5, drift_threshold: float = 0,
+                 refit_cooldown: int = 60):
+        self.interval = interval
+        self.lookback = lookback
+        self.alpha = alpha
+        self.drift_threshold = drift_threshold
+        # the minutes before a recomputed drifted service could be recomputed again
+        self.refit_cooldown = refit_cooldown
+
+
+class Corrector:
+    """
+    Correct the stored baseline between the calculations, by the exponentially weighted mean of the residuals
+    between the newest observed values and the predicted values. The level is added to the predicted values
+    from the first observed one, so the next correction of the same data finds no residual, and the level is
+    never added twice.
+    When the ratio of the newest observed values out of the predicted range exceeds the drift threshold,
+    the service is recomputed immediately instead of being corrected. A service still being recomputed, or
+    recomputed in the refit cooldown, is not queued again.
+    """
+
+    def __init__(self, calculator: Calculator, conf: CorrectionConfig):
+        self.calculator = calculator
+        self.conf = conf
+        # the correction runs besides the calculation, its own fetcher keeps the services of the calculation
+        self.fetcher = copy.copy(calculator.fetcher)
+        self.refits_lock = threading.Lock()
+        # the services being recomputed of each metric
+        self.refitting: dict[str, set[str]] = {}
+        # the timestamp in seconds of the last finished recompute of each metric and service
+        self.refitted: dict[str, dict[str, float]] = {}
+
+    def start(self):
+        fetcher = self.fetcher
+        try:
+            fetcher.ready_fetch()
+        except Exception as e:
+            logger.error(f"Ready to fetch data failure, skip correct predict: {e}")
+            return
+        for meter in fetcher.metric_names():
+            try:
+                with correct_metrics_time.labels(meter).time():
+                    self.correct(meter)
+            except Exception as e:
+                logger.error(f"Correct metrics {meter} failure: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
+
+    def correct(self, meter: str):
+        data = self.fetcher.fetch_recent(meter, self.conf.lookback)
+        if data is None or len(data.df) == 0:
+            logger.info(f"no recent data fetched for {meter}, skip correct")
+            return
+        observed = observed_series(data)
+        drifted: set[str] = set()
+        with self.calculator.saver.lock(meter):
+            results = self.calculator.saver.load(meter)
+            corrected = 0
+            for result in results:
+                service_observed = observed.get(result.service_name, {})
+                if self.is_drifted(result, service_observed):
+                    drifted.add(result.service_name)
+                    continue
+                corrected += self.correct_result(result, service_observed)
+            if corrected > 0:
+                self.calculator.saver.save(meter, results)
+        if corrected > 0:
+            self.calculator.saver.refresh(meter)
+        correct_series_count.labels(meter).inc(corrected)
+        logger.info(f"corrected {corrected} series of {meter} by the recent {self.conf.lookback} hours data")
+
+        if drifted:
+            self.refit(meter, drifted)
+
+    def refit(self, meter: str, drifted: set[str]):
+        now = time.time()
+        with self.refits_lock:
+            refitting = self.refitting.setdefault(meter, set())
+            # only the services still in the cooldown are kept
+            refitted = {service: finished for service, finished in self.refitted.get(meter, {}).items()
+                        if now - finished < self.conf.refit_cooldown * 60}
+            self.refitted[meter] = refitted
+            services = {service for service in drifted if service not in refitting and service not in refitted}
+            refitting.update(services)
+        logger.info(f"total {len(drifted)} services of {meter} drifted out of the baseline, queue {len(services)} "
+                    f"of them to recompute, {len(drifted) - len(services)} are being or recently recomputed")
+        if not services:
+            return
+        correct_drift_refit_count.labels(meter).inc(len(services))
+
+        def finished(future: Future):
+            with self.refits_lock:
+                self.refitting[meter] -= services
+                finished_time = time.time()
+                for service in services:
+                    self.refitted[meter][service] = finished_time
+
+        try:
+            self.calculator.recompute(meter, services).add_done_callback(finished)
+        except BaseException:
+            with self.refits_lock:
+                self.refitting[meter] -= services
+            raise
+
+    def is_drifted(self, result: PredictMeterResult,
+                   observed: dict[Optional[frozenset[LabelKeyValue]], pd.DataFrame]) -> bool:
+        if self.conf.drift_threshold <= 0:
+            return False
+        series = []
+        if result.single is not None and None in observed:
+            series.append((result.single, observed[None]))
+        for labeled in result.labeled or []:
+            if labeled.label in observed:
+                series.append((labeled.time_with_values, observed[labeled.label]))
+        for values, observed_df in series:
+            predicted = {value.timestamp: value.value for value in values}
+            total, outside = 0, 0
+            for ds, y in zip(observed_df['ds'], observed_df['y']):
+                if ds not in predicted:
+                    continue
+                total += 1
+                if y > predicted[ds].upper_value or y < predicted[ds].lower_value:
+                    outside += 1
+            if total > 0 and outside / total > self.conf.drift_threshold:
+                return True
+        return False
+
+    def correct_result(self, result: PredictMeterResult,
+                       observed: dict[Optional[frozenset[LabelKeyValue]], pd.DataFrame]) -> int:
+        corrected = 0
+        if result.single is not None and None in observed:
+            corrected += self.correct_values(result.single, observed[None])
+        for labeled in result.labeled or []:
+            if labeled.label in observed:
+                corrected += self.correct_values(labeled.time_with_values, observed[labeled.label])
+        return corrected
+
+    def correct_values(self, values: list[PredictTimestampWithSingleValue], observed: pd.DataFrame) -> int:
+        predicted = {value.timestamp: value.value.value for value in values}
+        level, weight, first_observed = 0.0, 0.0, None
+        for ds, y in zip(observed['ds'], observed['y']):
+            if ds not in predicted:
+                continue
+            level = self.conf.alpha * (float(y) - predicted[ds]) + (1 - self.conf.alpha) * level
+            weight = self.conf.alpha + (1 - self.conf.alpha) * weight
+            if first_observed is None:
+                first_observed = ds
+        if first_observed is None or abs(level / weight) < correction_epsilon:
+            return 0
+        level /= weight
+        for value in values:
+            if value.timestamp < first_observed:
+                continue
+            value.value.value = max(value.value.value + level, 0)
+            value.value.upper_value = max(value.value.upper_value + level, 0)
+            value.value.lower_value = max(value.value.lower_value + level, 0)
+        return 1
+
+
+def observed_series(data: FetchedData) -> dict[str, dict[Optional[frozenset[LabelKeyValue]], pd.DataFrame]]:
+    """
+    Split the fetched data to the observed values of each service(and labels), the labels is None for
+    the single value metrics.
+    """
+    result: dict[str, dict[Optional[frozenset[LabelKeyValue]], pd.DataFrame]] = {}
+    if data.single is not None:
+        frame = compact_series_frame(data.df, data.single.service_name_column, data.single.timestamp_column,
+                                     {data.single.value_column: 'y'}, data.single.time_format).dropna()
+        for service_name, service_df in frame.groupby('service', observed=True):
+            result[service_name] = {None: service_df}
+    elif data.multiple is not None:
+        value_columns = {val_conf.value: val_conf.value for val_conf in data.multiple.value_columns}
+        frame = compact_series_frame(data.df, data.multiple.service_name_column, data.multiple.time_stamp_column,
+                                     value_columns, data.multiple.time_format)
+        for service_name, service_df in frame.groupby('service', observed=True):
+            result[service_name] = {
+                frozenset(val_conf.tags): pd.DataFrame({'ds': service_df['ds'], 'y': service_df[val_conf.value]}).dropna()
+                for val_conf in data.multiple.value_columns
+            }
+    return result
@@ -0,0 +1,153 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import multiprocessing
+from abc import ABC, abstractmethod
+from statistics import NormalDist
+from typing import Optional
+
+import pandas as pd
+from prophet import Prophet
+
+logger = logging.getLogger(__name__)
+
+# the heavy modules imported once by the fork server, the forked processes start with them loaded
+preload_modules = ['pandas', 'prophet', 'cmdstanpy', 'baseline.predict']
+
+
+class FitTimeoutError(Exception):
+    pass
+
+
+class ForecastEngine(ABC):
+
+    @abstractmethod
+    def forecast(self, df: pd.DataFrame, periods: int, frequency: str) -> pd.DataFrame:
+        """
+        Fit the history(`ds` and `y` columns) and return the forecast with `ds`, `yhat`, `yhat_lower` and
+        `yhat_upper` columns, covering the history and `periods` future data points.
+        """
+        pass
+
+
+class ProphetEngine(ForecastEngine):
+
+    def __init__(self, interval_width: float = 0.8):
+        self.interval_width = interval_width
+
+    def forecast(self, df: pd.DataFrame, periods: int, frequency: str) -> pd.DataFrame:
+        m = Prophet(daily_seasonality=True, weekly_seasonality=False, yearly_seasonality=False,
+                    interval_width=self.interval_width)
+        m.fit(df)
+        future = m.make_future_dataframe(periods=periods, freq=frequency)
+        return m.predict(future)
+
+
+class SeasonalProfileEngine(ForecastEngine):
+    """
+    Predict every data point with the mean of the same hour of day in the history, the range is
+    built from the standard deviation of that hour.
+    """
+
+    def __init__(self, interval_width: float = 0.8):
+        self.interval_width = interval_width
+
+    def forecast(self, df: pd.DataFrame, periods: int, frequency: str) -> pd.DataFrame:
+        z = NormalDist().inv_cdf(0.5 + self.interval_width / 2)
+        hours = df['ds'].dt.hour
+        y = df['y'].astype('float64')
+        mean = y.groupby(hours).mean()
+        std = y.groupby(hours).std().fillna(0)
+
+        future_ds = pd.date_range(start=df['ds'].max(), periods=periods + 1, freq=frequency)[1:]
+        ds = pd.concat([df['ds'], pd.Series(future_ds)], ignore_index=True)
+        future_hours = ds.dt.hour
+        yhat = future_hours.map(mean).fillna(y.mean())
+        width = future_hours.map(std).fillna(0) * z
+        return pd.DataFrame({
+            'ds': ds,
+            'yhat': yhat,
+            'yhat_lower': yhat - width,
+            'yhat_upper': yhat + width,
+        })
+
+
+engine_names = ['prophet', 'seasonal']
+
+
+def check_engine(name: str):
+    if name.lower() not in engine_names:
+        raise ValueError(f"Unknown forecast engine: {name}, supported: {', '.join(engine_names)}")
+
+
+def create_engine(name: str, interval_width: float) -> ForecastEngine:
+    check_engine(name)
+    if name.lower() == 'prophet':
+        return ProphetEngine(interval_width)
+    return SeasonalProfileEngine(interval_width)
+
+
+def forecast_with_timeout(engine: ForecastEngine, df: pd.DataFrame, periods: int, frequency: str,
+                          timeout: float) -> pd.DataFrame:
+    """
+    Run the forecast in a dedicated process, the process would be killed when it cannot finish in the timeout
+    seconds, and raise the FitTimeoutError.
+    """
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(preload_modules)
+    receiver, sender = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_forecast_in_process, args=(engine, df, periods, frequency, sender), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            process.kill()
+            raise FitTimeoutError(f"forecast not finished in {timeout} seconds")
+        success, payload = receiver.recv()
+        if not success:
+            raise Exception(payload)
+        return payload
+    finally:
+        receiver.close()
+        process.join()
+
+
+def warm_up_worker(level: int, formatter: Optional[logging.Formatter]):
+    """
+    Initialize the worker process forked from the fork server: apply the logging of the parent and load the
+    compiled Stan model once, before the first task arrives.
+    """
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        if formatter is not None:
+            handler.setFormatter(formatter)
+        root.addHandler(handler)
+    logging.getLogger('cmdstanpy').setLevel(logging.WARN)
+    try:
+        Prophet()
+    except Exception as e:
+        logger.warning(f"warm up the Prophet model failure: {e}")
+
+
+def _forecast_in_process(engine: ForecastEngine, df: pd.DataFrame, periods: int, frequency: str, sender):
+    logging.getLogger('cmdstanpy').setLevel(logging.WARN)
+    try:
+        sender.send((True, engine.forecast(df, periods, frequency)))
+    except Exception as e:
+        sender.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        sender.close()
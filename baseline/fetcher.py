@@ -14,6 +14,8 @@
 import logging
 from abc import ABC, abstractmethod
 import datetime
+import threading
+import time
 from typing import Optional
 
 import pandas as pd
@@ -40,6 +42,12 @@ class LabelKeyValue:
     def __str__(self):
         return "%s=%s" % (self.key, self.value)
 
+    def __eq__(self, other):
+        return isinstance(other, LabelKeyValue) and self.key == other.key and self.value == other.value
+
+    def __hash__(self):
+        return hash((self.key, self.value))
+
     @staticmethod
     def from_dict(d: dict) -> "LabelKeyValue":
         return LabelKeyValue(d["key"], d["value"])
@@ -96,10 +104,34 @@ class Fetcher(ABC):
     def ready_fetch(self):
         pass
 
+    def service_names(self) -> Optional[list[str]]:
+        """
+        The service names could be fetched one by one, None means the fetcher only fetches the whole metric.
+        """
+        return None
+
+    def selected_services(self) -> Optional[set[str]]:
+        """
+        The services selected to be calculated, the stored baseline of the others is always kept. None means all.
+        """
+        return None
+
+    def fetch_stats(self) -> tuple[int, float]:
+        """
+        The total bytes fetched and the seconds spent on fetching by this fetcher.
+        """
+        return 0, 0.0
+
     @abstractmethod
-    def fetch(self, metric_name: str) -> Optional[FetchedData]:
+    def fetch(self, metric_name: str, services: Optional[set[str]] = None) -> Optional[FetchedData]:
+        """
+        Fetch the metrics of all services, or only the given service names.
+        """
         pass
 
+    def fetch_recent(self, metric_name: str, hours: int) -> Optional[FetchedData]:
+        return self.fetch(metric_name)
+
 
 class GraphQLFetcher(Fetcher):
 
@@ -107,11 +139,25 @@ class GraphQLFetcher(Fetcher):
         self.conf = conf
         self.services = None
         self.total_period = None
-        self.metrics = conf.metrics
+        self.fetched_bytes = 0
+        self.fetch_seconds = 0.0
+        # the data is fetched by the concurrent threads of the pipeline
+        self.stats_lock = threading.Lock()
+        self.metrics = conf.enabled_metric_names()
         self.base_address = conf.server.address if not conf.server.address.endswith("/") else conf.server.address[:-1]
 
+    def __getstate__(self):
+        # the fetcher is sent to the worker processes, the lock cannot be pickled
+        state = self.__dict__.copy()
+        del state['stats_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stats_lock = threading.Lock()
+
     def metric_names(self) -> list[str]:
-        return self.conf.metrics
+        return self.metrics
 
     def ready_fetch(self):
         all_services = set()
@@ -122,17 +168,38 @@ class GraphQLFetcher(Fetcher):
         self.services = all_services
         self.total_period = self.query_need_period()
 
-    def fetch(self, metric_name: str) -> Optional[FetchedData]:
+    def fetch_stats(self) -> tuple[int, float]:
+        with self.stats_lock:
+            return self.fetched_bytes, self.fetch_seconds
+
+    def service_names(self) -> Optional[list[str]]:
+        if self.services is None:
+            return None
+        return sorted({service for service, _ in self.services})
+
+    def fetch(self, metric_name: str, services: Optional[set[str]] = None) -> Optional[FetchedData]:
         if self.services is None or len(self.services) == 0:
             return None
         fetch_data = None
         for (service, normal) in self.services:
+            if services is not None and service not in services:
+                continue
             fetch_data = self.fetch_service_metrics(service, normal, metric_name, fetch_data)
         return fetch_data
 
-    def fetch_service_metrics(self, service_name: str, normal: bool, metric_name: str, prev_data: FetchedData) -> FetchedData:
+    def fetch_recent(self, metric_name: str, hours: int) -> Optional[FetchedData]:
+        if self.services is None or len(self.services) == 0:
+            return None
+        period = hours * 60 if self.conf.server.down_sampling.lower() == 'minute' else hours
+        fetch_data = None
+        for (service, normal) in self.services:
+            fetch_data = self.fetch_service_metrics(service, normal, metric_name, fetch_data, period)
+        return fetch_data
+
+    def fetch_service_metrics(self, service_name: str, normal: bool, metric_name: str, prev_data: FetchedData,
+                              period: Optional[int] = None) -> FetchedData:
         count = 0
-        for start, end in self.generate_time_buckets():
+        for start, end in self.generate_time_buckets(period):
             prev_data, per_count = self.fetch_service_metrics_with_rangs(service_name, normal, metric_name, prev_data, start, end)
             count += per_count
         logger.info(f"Total fetched {count} data points for {metric_name}(service: {service_name})")
@@ -276,21 +343,22 @@ class GraphQLFetcher(Fetcher):
             return total_days * 24 * 60
         raise Exception("Unsupported down sampling: %s" % sampling)
 
-    def generate_time_buckets(self) -> list[tuple[str, str]]:
+    def generate_time_buckets(self, period: Optional[int] = None) -> list[tuple[str, str]]:
         end_time = datetime.datetime.now()
         sampling = self.conf.server.down_sampling.lower()
+        total_period = period if period is not None else self.total_period
         if sampling == 'hour':
-            start_time = end_time - datetime.timedelta(hours=self.total_period)
+            start_time = end_time - datetime.timedelta(hours=total_period)
             return self.generate_time_buckets_by_range(start_time, end_time, self.delta_hour, '%Y-%m-%d %H')
         elif sampling == 'minute':
-            start_time = end_time - datetime.timedelta(minutes=self.total_period)
+            start_time = end_time - datetime.timedelta(minutes=total_period)
             return self.generate_time_buckets_by_range(start_time, end_time, self.delta_minute, '%Y-%m-%d %H%M')
         raise Exception("Unsupported down sampling: %s" % sampling)
 
     def generate_time_buckets_by_range(self, start, end, delta, formate) -> list[tuple[str, str]]:
         cur_end_time = start + delta(max_fetch_data_period - 1)
         if cur_end_time > end:
-            return [start.strftime(formate), end.strftime(formate)]
+            return [(start.strftime(formate), end.strftime(formate))]
         results = []
         while start < cur_end_time < end:
             results.append([start.strftime(formate), cur_end_time.strftime(formate)])
@@ -334,11 +402,15 @@ class GraphQLFetcher(Fetcher):
         else:
             auth = None
 
+        start = time.perf_counter()
         response = requests.post(
             address,
             json=payload,
             auth=auth,
             headers={"Content-Type": "application/json"})
+        with self.stats_lock:
+            self.fetch_seconds += time.perf_counter() - start
+            self.fetched_bytes += len(response.content)
 
         if response.status_code != 200:
             raise Exception("Failed to fetch data from GraphQL: %s" % response.text)
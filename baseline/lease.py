@@ -0,0 +1,178 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseManager(ABC):
+    """
+    The leases of the work units shared by all replicas. A unit is calculated by the replica holding its lease,
+    the lease expires when not renewed in the TTL, then it could be taken over by the other replicas.
+    """
+
+    @abstractmethod
+    def acquire(self, unit: str, cycle: str) -> bool:
+        """
+        Acquire the lease of the unit, fails when it is held by another live replica or completed in the cycle.
+        """
+        pass
+
+    @abstractmethod
+    def renew(self, unit: str) -> bool:
+        pass
+
+    @abstractmethod
+    def complete(self, unit: str, cycle: str):
+        """
+        Mark the unit completed in the cycle, no replica acquires it again until the next cycle.
+        """
+        pass
+
+    @abstractmethod
+    def release(self, unit: str):
+        pass
+
+    @abstractmethod
+    def is_completed(self, unit: str, cycle: str) -> bool:
+        pass
+
+
+class FileLeaseManager(LeaseManager):
+    """
+    The leases stored as files in a directory, such as a volume shared by all replicas. Each lease file is
+    replaced atomically, and guarded by a file lock while being read and modified.
+    """
+
+    def __init__(self, dir: str, ttl: float, owner: Optional[str] = None):
+        self.dir = dir
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        os.makedirs(dir, exist_ok=True)
+
+    def acquire(self, unit: str, cycle: str) -> bool:
+        with self.guard(unit):
+            lease = self.read(unit)
+            if lease is not None:
+                if lease.get('completed') == cycle:
+                    return False
+                if lease['owner'] != self.owner and lease['expires'] > time.time():
+                    return False
+                if lease['owner'] != self.owner and lease.get('completed') is None:
+                    logger.info(f"take over the expired lease of {unit} from {lease['owner']}")
+            self.write(unit, {'owner': self.owner, 'expires': time.time() + self.ttl, 'completed': None})
+            return True
+
+    def renew(self, unit: str) -> bool:
+        with self.guard(unit):
+            lease = self.read(unit)
+            if lease is None or lease['owner'] != self.owner:
+                return False
+            lease['expires'] = time.time() + self.ttl
+            self.write(unit, lease)
+            return True
+
+    def complete(self, unit: str, cycle: str):
+        with self.guard(unit):
+            self.write(unit, {'owner': self.owner, 'expires': 0, 'completed': cycle})
+
+    def release(self, unit: str):
+        with self.guard(unit):
+            lease = self.read(unit)
+            if lease is not None and lease['owner'] == self.owner:
+                self.write(unit, {'owner': self.owner, 'expires': 0, 'completed': None})
+
+    def is_completed(self, unit: str, cycle: str) -> bool:
+        lease = self.read(unit)
+        return lease is not None and lease.get('completed') == cycle
+
+    @contextlib.contextmanager
+    def guard(self, unit: str):
+        with open(f"{self.dir}/{unit}.lock", 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self, unit: str) -> Optional[dict]:
+        try:
+            with open(f"{self.dir}/{unit}.lease", 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"reading the lease of {unit} failure, treated as expired: {e}")
+            return None
+
+    def write(self, unit: str, lease: dict):
+        fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=f".{unit}.", suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(lease, f)
+        os.replace(tmp, f"{self.dir}/{unit}.lease")
+
+
+class WorkUnit:
+    """
+    A part of the services of a metric calculated by one replica, None services means all services.
+    """
+
+    def __init__(self, meter: str, shard: int, services: Optional[set[str]] = None, shards: int = 1):
+        self.meter = meter
+        self.shard = shard
+        self.services = services
+        self.shards = shards
+
+    def __contains__(self, service: str) -> bool:
+        # the service belongs to this unit by the hash, even it is not listed now
+        return self.services is None or service_shard(service, self.shards) == self.shard
+
+    @property
+    def name(self) -> str:
+        return f"{self.meter}.{self.shard}"
+
+
+class Coordinator:
+    """
+    Partition the metrics to the work units by the service name hash, the replicas claim the units by the leases.
+    """
+
+    def __init__(self, leases: LeaseManager, shards: int, renew_interval: float):
+        self.leases = leases
+        self.shards = max(shards, 1)
+        self.renew_interval = renew_interval
+
+    def units(self, meter: str, services: Optional[list[str]]) -> list[WorkUnit]:
+        # the fetcher could not list the services, the whole metric is a unit
+        if services is None or self.shards == 1:
+            return [WorkUnit(meter, 0)]
+        shards: list[set[str]] = [set() for _ in range(self.shards)]
+        for service in services:
+            shards[service_shard(service, self.shards)].add(service)
+        return [WorkUnit(meter, shard, shard_services, self.shards) for shard, shard_services in enumerate(shards)]
+
+
+def service_shard(service: str, shards: int) -> int:
+    return zlib.crc32(service.encode('utf-8')) % shards
@@ -0,0 +1,150 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import contextlib
+import logging
+import os
+import resource
+import threading
+import time
+from typing import Optional
+
+from prometheus_client import Counter
+
+logger = logging.getLogger(__name__)
+
+memory_admission_wait_count = Counter('memory_admission_wait_count',
+                                      'The number of fit tasks waited for the memory headroom', ['name'])
+
+# the limit values larger than this are treated as no limit in the cgroup v1
+unlimited_memory = 1 << 60
+
+cgroup_limit_files = ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']
+cgroup_usage_files = ['/sys/fs/cgroup/memory.current', '/sys/fs/cgroup/memory/memory.usage_in_bytes']
+
+
+def read_memory_file(files: list[str]) -> Optional[int]:
+    for file in files:
+        try:
+            with open(file) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == 'max':
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            continue
+        return value if value < unlimited_memory else None
+    return None
+
+
+def read_meminfo() -> dict[str, int]:
+    info = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                info[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return info
+
+
+def memory_limit() -> Optional[int]:
+    """
+    The memory limit in bytes of the container from the cgroup, or the total memory of the host.
+    """
+    limit = read_memory_file(cgroup_limit_files)
+    if limit is not None:
+        return limit
+    return read_meminfo().get('MemTotal')
+
+
+def memory_usage() -> Optional[int]:
+    """
+    The used memory in bytes of the container from the cgroup, or the used memory of the host.
+    """
+    if read_memory_file(cgroup_limit_files) is not None:
+        usage = read_memory_file(cgroup_usage_files)
+        if usage is not None:
+            return usage
+    info = read_meminfo()
+    if 'MemTotal' not in info or 'MemAvailable' not in info:
+        return None
+    return info['MemTotal'] - info['MemAvailable']
+
+
+def current_rss() -> int:
+    """
+    The resident memory in bytes of the current process, fallback to the peak when /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryGovernor:
+    """
+    Admit the fit tasks of the process only while the used memory is under the ratio of the limit. A task is always
+    admitted when no other task of the process is running, or the deadline reached, so the calculation keeps going.
+    """
+
+    def __init__(self, limit_ratio: float, poll_interval: float = 1):
+        self.limit_ratio = limit_ratio
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.running = 0
+
+    @contextlib.contextmanager
+    def admit(self, name: str, deadline: Optional[float] = None):
+        with self.condition:
+            waited = False
+            while self.running > 0 and not self.has_headroom() and (deadline is None or time.time() < deadline):
+                if not waited:
+                    waited = True
+                    memory_admission_wait_count.labels(name).inc()
+                    logger.debug(f"waiting for the memory headroom to fit {name}, running fits: {self.running}")
+                self.condition.wait(self.poll_interval)
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+
+    def has_headroom(self) -> bool:
+        limit, usage = memory_limit(), memory_usage()
+        if limit is None or usage is None:
+            return True
+        return usage < limit * self.limit_ratio
+
+
+_governor: Optional[MemoryGovernor] = None
+_governor_lock = threading.Lock()
+
+
+def process_governor(limit_ratio: float) -> MemoryGovernor:
+    """
+    The governor shared by all calculations in the current process.
+    """
+    global _governor
+    with _governor_lock:
+        if _governor is None or _governor.limit_ratio != limit_ratio:
+            _governor = MemoryGovernor(limit_ratio)
+        return _governor
@@ -12,18 +12,26 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import bisect
+import copy
 import datetime
 import logging
+import operator
+import queue
+import threading
 import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Any, Callable, Optional
 
+import numpy as np
 import pandas as pd
-from prometheus_client import Counter, Summary
-from prophet import Prophet
+from prometheus_client import Counter, Gauge, Summary
 
+from baseline.cluster import ClusterConfig, build_clusters
+from baseline.engine import SeasonalProfileEngine, FitTimeoutError, check_engine, create_engine, forecast_with_timeout
 from baseline.fetcher import LabelKeyValue, Fetcher, FetchedData
+from baseline.memory import process_governor
 
 logger = logging.getLogger(__name__)
 
@@ -34,13 +42,71 @@ predict_metrics_group_metrics_time = Summary('predict_metrics_group_metrics_time
                                              ['name'])
 predict_metrics_single_time = Summary('predict_metrics_single_time', 'The time spent on predict single metrics',
                                       ['name'])
+predict_cluster_fit_count = Counter('predict_cluster_fit_count', 'The number of shared models fitted for clusters',
+                                    ['name'])
+predict_cluster_individual_fit_count = Counter('predict_cluster_individual_fit_count',
+                                               'The number of series fitted individually in cluster mode', ['name'])
+predict_fit_timeout_count = Counter('predict_fit_timeout_count',
+                                    'The number of series fit exceeded the timeout and fallback to seasonal profile',
+                                    ['name'])
+predict_pipeline_queue_size = Gauge('predict_pipeline_queue_size',
+                                    'The number of series waiting in the stage of the pipeline', ['name', 'stage'],
+                                    multiprocess_mode='livesum')
+
+
+class PipelineConfig:
+    def __init__(self, enabled: bool = False, fetch_concurrency: int = 4, fit_concurrency: int = 0,
+                 queue_size: int = 16):
+        self.enabled = enabled
+        self.fetch_concurrency = fetch_concurrency
+        self.fit_concurrency = fit_concurrency
+        self.queue_size = queue_size
 
 
 class PredictConfig:
-    def __init__(self, min_days: int, frequency: str, period: int):
+    def __init__(self, min_days: int, frequency: str, period: int, cluster: Optional[ClusterConfig] = None,
+                 fit_timeout: float = 0, engine: str = 'prophet', window_days: int = 0, interval_width: float = 0.8,
+                 recompute_interval: int = 0, refresh_horizon: int = 0, lazy_unqueried: bool = False,
+                 save_queue_size: int = 0, pipeline: Optional[PipelineConfig] = None, hot_refresh_horizon: int = 0):
         self.min_days = min_days
         self.frequency = frequency
         self.period = period
+        self.cluster = cluster
+        self.fit_timeout = fit_timeout
+        self.engine = engine
+        self.window_days = window_days
+        self.interval_width = interval_width
+        self.recompute_interval = recompute_interval
+        self.refresh_horizon = refresh_horizon
+        self.lazy_unqueried = lazy_unqueried
+        self.save_queue_size = save_queue_size
+        self.pipeline = pipeline
+        # the refresh horizon of the frequently queried services, which are recalculated earlier than the others
+        self.hot_refresh_horizon = hot_refresh_horizon
+        self.profiles: dict[str, PredictConfig] = {}
+
+    def override(self, **kwargs) -> "PredictConfig":
+        conf = copy.copy(self)
+        conf.profiles = {}
+        for key, val in kwargs.items():
+            if not hasattr(conf, key):
+                raise ValueError(f"Unknown predict config: {key}")
+            setattr(conf, key, val)
+        return conf
+
+    def for_metric(self, name: str) -> "PredictConfig":
+        return self.profiles.get(name, self)
+
+    def validate(self):
+        """
+        Fail at the startup on the invalid configurations, instead of failing every calculation.
+        """
+        check_engine(self.engine)
+        for name, profile in self.profiles.items():
+            try:
+                check_engine(profile.engine)
+            except ValueError as e:
+                raise ValueError(f"Invalid predict profile of {name}: {e}") from e
 
 
 class ReadyPredictMeter:
@@ -67,18 +133,29 @@ class PredictValue:
 
 
 class PredictTimestampWithSingleValue:
-    timestamp: pd.Timestamp
     value: PredictValue
+    # the hour time bucket of the timestamp in the `YYYYMMDDHH` format, same as the query
+    time_bucket: int
 
-    def __init__(self, timestamp: pd.Timestamp, value: PredictValue):
-        self.timestamp = timestamp
+    def __init__(self, timestamp: Any, value: PredictValue, time_bucket: Optional[int] = None):
+        # the stored timestamp(ISO string or nanoseconds) is decoded on the first access,
+        # the query only reads the time bucket
+        self._timestamp = timestamp
         self.value = value
+        self.time_bucket = time_bucket if time_bucket is not None else timestamp_to_time_bucket(self.timestamp)
+
+    @property
+    def timestamp(self) -> pd.Timestamp:
+        if not isinstance(self._timestamp, pd.Timestamp):
+            self._timestamp = pd.Timestamp(self._timestamp)
+        return self._timestamp
 
     @staticmethod
     def from_dict(d: dict) -> "PredictTimestampWithSingleValue":
         return PredictTimestampWithSingleValue(
-            pd.Timestamp(d["timestamp"]),
-            PredictValue.from_dict(d["value"])
+            d["timestamp"],
+            PredictValue.from_dict(d["value"]),
+            d.get("time_bucket")
         )
 
 
@@ -111,14 +188,34 @@ class PredictMeterResult:
         self.single = single
         self.labeled = labeled
 
-    def filter_time(self, start: pd.Timestamp, end: pd.Timestamp):
+    def max_timestamp(self) -> Optional[pd.Timestamp]:
+        timestamps = [entry.timestamp for entry in self.single or []]
+        for labeled_entry in self.labeled or []:
+            timestamps.extend(entry.timestamp for entry in labeled_entry.time_with_values)
+        return max(timestamps) if timestamps else None
+
+    def filter_time(self, start_bucket: int, end_bucket: int):
         if self.single:
-            self.single = [entry for entry in self.single if start <= entry.timestamp <= end]
+            self.single = time_bucket_slice(self.single, start_bucket, end_bucket)
         if self.labeled:
             for labeled_entry in self.labeled:
-                labeled_entry.time_with_values = [
-                    entry for entry in labeled_entry.time_with_values if start <= entry.timestamp <= end
-                ]
+                labeled_entry.time_with_values = time_bucket_slice(labeled_entry.time_with_values,
+                                                                   start_bucket, end_bucket)
+
+    def time_range(self, start_bucket: int, end_bucket: int) -> "PredictMeterResult":
+        """
+        The copy of the result in the time bucket range, the result itself is not modified.
+        """
+        single, labeled = None, None
+        if self.single is not None:
+            single = time_bucket_slice(self.single, start_bucket, end_bucket)
+        if self.labeled is not None:
+            labeled = [PredictLabeledWithLabeledValue(labeled_entry.label, time_bucket_slice(
+                labeled_entry.time_with_values, start_bucket, end_bucket)) for labeled_entry in self.labeled]
+        return PredictMeterResult(self.service_name, single, labeled)
+
+    def points(self) -> int:
+        return len(self.single or []) + sum(len(entry.time_with_values) for entry in self.labeled or [])
 
     @staticmethod
     def from_dict(d: dict) -> "PredictMeterResult":
@@ -130,6 +227,55 @@ class PredictMeterResult:
         return PredictMeterResult(d["service_name"], single, labeled)
 
 
+class PredictStats:
+    def __init__(self):
+        self.series = 0
+        self.fetch_bytes = 0
+        self.fetch_seconds = 0.0
+        self.fit_seconds: list[float] = []
+
+    def merge(self, other: "PredictStats"):
+        self.series += other.series
+        self.fetch_bytes += other.fetch_bytes
+        self.fetch_seconds += other.fetch_seconds
+        self.fit_seconds.extend(other.fit_seconds)
+
+
+class PredictBatchResult:
+    results: list[PredictMeterResult]
+    unfinished: list[str]
+    forecast_ends: dict[str, pd.Timestamp]
+    stats: PredictStats
+
+    def __init__(self, results: list[PredictMeterResult], unfinished: Optional[list[str]] = None):
+        self.results = results
+        # the services not calculated before the deadline
+        self.unfinished = unfinished or []
+        self.forecast_ends = {}
+        self.stats = PredictStats()
+        for result in results:
+            self.track(result)
+
+    def add(self, result: PredictMeterResult):
+        self.results.append(result)
+        self.track(result)
+
+    def track(self, result: PredictMeterResult):
+        self.stats.series += 1 if result.single is not None else len(result.labeled or [])
+        end = result.max_timestamp()
+        if end is not None:
+            self.forecast_ends[result.service_name] = end
+
+    def without_results(self) -> "PredictBatchResult":
+        """
+        The summary of the batch, which is small enough to send back to the parent process after the results saved.
+        """
+        summary = PredictBatchResult([], self.unfinished)
+        summary.forecast_ends = self.forecast_ends
+        summary.stats = self.stats
+        return summary
+
+
 def meter_to_result(meter: ReadyPredictMeter, single: Optional[pd.DataFrame] = None,
                     multiple: Optional[dict[frozenset[LabelKeyValue], pd.DataFrame]] = None) -> PredictMeterResult:
     if single is not None:
@@ -159,45 +305,235 @@ def meter_to_result(meter: ReadyPredictMeter, single: Optional[pd.DataFrame] = N
         return PredictMeterResult(meter.service_name, labeled=result)
 
 
+def timestamp_to_time_bucket(ts: pd.Timestamp) -> int:
+    return ts.year * 1000000 + ts.month * 10000 + ts.day * 100 + ts.hour
+
+
+time_bucket_key = operator.attrgetter('time_bucket')
+
+
+def nanos_to_time_buckets(nanos: np.ndarray) -> np.ndarray:
+    """
+    The time buckets of the epoch nanoseconds, converted in bulk without building the timestamps.
+    """
+    times = np.asarray(nanos, dtype=np.int64).astype('datetime64[ns]')
+    days = times.astype('datetime64[D]')
+    months = times.astype('datetime64[M]')
+    years = times.astype('datetime64[Y]')
+    hour = (times - days).astype('timedelta64[h]').astype(np.int64)
+    day = (days - months).astype(np.int64) + 1
+    month = (months - years).astype(np.int64) + 1
+    year = years.astype(np.int64) + 1970
+    return year * 1000000 + month * 10000 + day * 100 + hour
+
+
+def time_bucket_slice(values: list[PredictTimestampWithSingleValue], start_bucket: int,
+                      end_bucket: int) -> list[PredictTimestampWithSingleValue]:
+    """
+    The values in the time bucket range(inclusive), the values must be sorted by the time, as they are predicted
+    and saved in the time order.
+    """
+    return values[bisect.bisect_left(values, start_bucket, key=time_bucket_key):
+                  bisect.bisect_right(values, end_bucket, key=time_bucket_key)]
+
+
 def ignore_nagative_value(value: int) -> int:
     return value if value > 0 else 0
 
 
 class PredictService:
 
-    def __init__(self, fetcher: Fetcher, name: str, conf: PredictConfig):
+    def __init__(self, fetcher: Fetcher, name: str, conf: PredictConfig, skip_services: Optional[set[str]] = None,
+                 priorities: Optional[dict[str, float]] = None, services: Optional[set[str]] = None,
+                 deadline: Optional[float] = None, memory_limit_ratio: float = 0):
         self.fetcher = fetcher
         self.name = name
         self.conf = conf
+        self.skip_services = skip_services or set()
+        self.priorities = priorities or {}
+        self.services = services
+        self.deadline = deadline
+        # only fit while the used memory is under this ratio of the memory limit, 0 means no limit
+        self.memory_limit_ratio = memory_limit_ratio
         self.future_max_time = calc_max_predict_time(conf)
-
-    def predict(self) -> list[PredictMeterResult]:
+        self.engine = create_engine(conf.engine, conf.interval_width)
+        self.fallback_engine = SeasonalProfileEngine(conf.interval_width)
+        # when set, each result is handed over as soon as the service calculated, instead of held in the batch
+        self.result_handler: Optional[Callable[[PredictMeterResult], None]] = None
+        self.fit_seconds: list[float] = []
+        # guards the batch and the statistics updated by the fitting threads
+        self.mutex = threading.Lock()
+
+    def __getstate__(self):
+        # the service is sent to the worker processes, the lock cannot be pickled
+        state = self.__dict__.copy()
+        del state['mutex']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.mutex = threading.Lock()
+
+    def predict(self) -> PredictBatchResult:
+        self.fit_seconds = []
+        fetched_bytes, fetch_seconds = self.fetcher.fetch_stats()
         with predict_metrics_total_time.labels(self.name).time():
-            return self.predict0()
-
-    def predict0(self) -> list[PredictMeterResult]:
+            batch = self.predict0()
+        total_bytes, total_seconds = self.fetcher.fetch_stats()
+        batch.stats.fetch_bytes = total_bytes - fetched_bytes
+        batch.stats.fetch_seconds = total_seconds - fetch_seconds
+        batch.stats.fit_seconds = self.fit_seconds
+        return batch
+
+    def predict0(self) -> PredictBatchResult:
         predict_total_count.labels(self.name).inc()
-        data = self.fetcher.fetch(self.name)
+        services = self.pipeline_services()
+        if services is not None:
+            return self.predict_pipelined(services)
+        data = self.fetcher.fetch(self.name, self.services)
         if data is None or len(data.df) == 0:
             logger.info(f"no data fetched for {self.name}")
-            return []
-        result: list[PredictMeterResult] = []
+            return PredictBatchResult([])
+        batch = PredictBatchResult([])
         with predict_metrics_group_metrics_time.labels(self.name).time():
             metrics = list(self.split_to_meter(data))
-        logger.info(f"total {len(metrics)} services in the {self.name} is available to calc baseline")
+        # the most queried services first
+        metrics.sort(key=lambda meter: -self.priorities.get(meter.service_name, 0))
+        logger.info(f"total {len(metrics)} services in the {self.name} is available to calc baseline, "
+                    f"{len(self.skip_services)} services still have enough predicted values")
         start_time = time.perf_counter()
         predict_metrics_count.labels(self.name).inc(len(metrics))
 
-        with ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self.process_meter, meter) for idx, meter in enumerate(metrics, 1)]
-            for future in futures:
+        with ThreadPoolExecutor(max_workers=self.fit_workers()) as executor:
+            if self.conf.cluster is not None and self.conf.cluster.enabled:
+                clustered = self.predict_clustered(metrics, executor)
+                for result in clustered.results:
+                    self.handle_result(batch, result)
+                batch.unfinished.extend(clustered.unfinished)
+            else:
+                futures = {executor.submit(self.process_and_handle, meter, batch): meter for meter in metrics}
+                batch.unfinished.extend(meter.service_name for meter in self.cancel_at_deadline(futures))
+                for future in futures:
+                    if future.cancelled():
+                        continue
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Error processing meter: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
+        end_time = time.perf_counter()
+        logger.info(f"process {self.name} metrics total use time {end_time - start_time:.6f} seconds")
+        if batch.unfinished:
+            logger.warning(f"total {len(batch.unfinished)} services in the {self.name} are not calculated before the deadline")
+        return batch
+
+    def process_and_handle(self, meter: ReadyPredictMeter, batch: PredictBatchResult):
+        self.handle_result(batch, self.process_meter(meter))
+
+    def handle_result(self, batch: PredictBatchResult, result: PredictMeterResult):
+        if self.result_handler is None:
+            with self.mutex:
+                batch.add(result)
+            return
+        self.result_handler(result)
+        with self.mutex:
+            batch.track(result)
+
+    def pipeline_services(self) -> Optional[list[str]]:
+        """
+        The services to calculate in the pipeline, the most queried services first. None means the pipeline is not
+        available, such as disabled, clustering enabled or the fetcher cannot list the services.
+        """
+        if self.conf.pipeline is None or not self.conf.pipeline.enabled:
+            return None
+        if self.conf.cluster is not None and self.conf.cluster.enabled:
+            return None
+        service_names = self.fetcher.service_names()
+        if service_names is None:
+            return None
+        services = [service for service in service_names
+                    if (self.services is None or service in self.services) and not self.should_skip(service)]
+        services.sort(key=lambda service: -self.priorities.get(service, 0))
+        return services
+
+    def predict_pipelined(self, services: list[str]) -> PredictBatchResult:
+        """
+        Fetch, fit and save the services concurrently: the fetch threads put the data of each service into a
+        bounded queue, each service is split and submitted to fit as soon as it fetched, and the results are
+        handed over to the result handler once fitted.
+        """
+        logger.info(f"total {len(services)} services in the {self.name} to calc baseline in pipeline, "
+                    f"{len(self.skip_services)} services still have enough predicted values")
+        start_time = time.perf_counter()
+        batch = PredictBatchResult([])
+        fetched: queue.Queue[tuple[str, Optional[FetchedData]]] = queue.Queue(maxsize=self.conf.pipeline.queue_size)
+        fetched_size = predict_pipeline_queue_size.labels(self.name, 'fit')
+
+        def fetch_service(service_name: str):
+            try:
+                data = self.fetcher.fetch(self.name, {service_name})
+            except Exception as e:
+                logger.error(f"Fetch {self.name}(service: {service_name}) failure: {e}")
+                data = None
+            fetched.put((service_name, data))
+            fetched_size.inc()
+
+        fit_futures: dict[Future, str] = {}
+        with ThreadPoolExecutor(max_workers=self.conf.pipeline.fetch_concurrency) as fetch_executor, \
+                ThreadPoolExecutor(max_workers=self.fit_workers()) as fit_executor:
+            fetch_futures = {fetch_executor.submit(fetch_service, service): service for service in services}
+            pending, deadline_reached = len(services), False
+            while pending > 0:
+                if not deadline_reached and self.deadline is not None and time.time() >= self.deadline:
+                    # the fetching services still send their data to the queue, drain it without fitting
+                    deadline_reached = True
+                    cancelled = [service for future, service in fetch_futures.items() if future.cancel()]
+                    batch.unfinished.extend(cancelled)
+                    pending -= len(cancelled)
+                    continue
                 try:
-                    result.append(future.result())
+                    timeout = None if deadline_reached or self.deadline is None else max(self.deadline - time.time(), 0)
+                    service_name, data = fetched.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                pending -= 1
+                fetched_size.dec()
+                if deadline_reached:
+                    batch.unfinished.append(service_name)
+                    continue
+                if data is None or len(data.df) == 0:
+                    logger.info(f"no data fetched for {self.name}(service: {service_name})")
+                    continue
+                for meter in self.split_to_meter(data):
+                    predict_metrics_count.labels(self.name).inc()
+                    fit_futures[fit_executor.submit(self.process_and_handle, meter, batch)] = meter.service_name
+
+            batch.unfinished.extend(self.cancel_at_deadline(fit_futures))
+            for future in fit_futures:
+                if future.cancelled():
+                    continue
+                try:
+                    future.result()
                 except Exception as e:
                     logger.error(f"Error processing meter: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
         end_time = time.perf_counter()
-        logger.info(f"process {self.name} metrics total use time {end_time - start_time:.6f} seconds")
-        return result
+        logger.info(f"process {self.name} metrics in pipeline total use time {end_time - start_time:.6f} seconds")
+        if batch.unfinished:
+            logger.warning(f"total {len(batch.unfinished)} services in the {self.name} are not calculated before the deadline")
+        return batch
+
+    def fit_workers(self) -> Optional[int]:
+        if self.conf.pipeline is None or self.conf.pipeline.fit_concurrency <= 0:
+            return None
+        return self.conf.pipeline.fit_concurrency
+
+    def cancel_at_deadline(self, futures: dict[Future, Any]) -> list[Any]:
+        """
+        Wait for the futures until the deadline, then cancel the not started ones and return their keys.
+        """
+        if self.deadline is None:
+            return []
+        _, not_done = wait(futures.keys(), timeout=max(self.deadline - time.time(), 0))
+        return [futures[future] for future in not_done if future.cancel()]
 
     def process_meter(self, meter: ReadyPredictMeter) -> PredictMeterResult:
         with predict_metrics_single_time.labels(self.name).time():
@@ -205,24 +541,115 @@ class PredictService:
 
     def process_meter0(self, meter: ReadyPredictMeter) -> PredictMeterResult:
         if meter.single_df is not None:
-            m = Prophet(daily_seasonality=True, weekly_seasonality=False, yearly_seasonality=False)
-            m.fit(meter.single_df)
-            future = m.make_future_dataframe(periods=self.calc_future_period(meter.single_df), freq=self.conf.frequency)
-            forecast = m.predict(future)
-            logger.info(f"Predicted for {meter.service_name} of {self.name} to {future["ds"].max()}")
+            forecast = self.fit_forecast(meter.single_df)
+            logger.info(f"Predicted for {meter.service_name} of {self.name} to {forecast["ds"].max()}")
             return meter_to_result(meter, single=forecast)
         elif meter.label_dfs is not None:
             multiple: dict[frozenset[LabelKeyValue], pd.DataFrame] = {}
-            future = None
+            forecast = None
             for labels, df in meter.label_dfs.items():
-                m = Prophet(daily_seasonality=True, weekly_seasonality=False, yearly_seasonality=False)
-                m.fit(df)
-                future = m.make_future_dataframe(periods=self.calc_future_period(df), freq=self.conf.frequency)
-                forecast = m.predict(future)
+                forecast = self.fit_forecast(df)
                 multiple[labels] = forecast
-            logger.info(f"Predicted for {meter.service_name} of {self.name} to {future["ds"].max()}")
+            logger.info(f"Predicted for {meter.service_name} of {self.name} to {forecast["ds"].max()}")
             return meter_to_result(meter, multiple=multiple)
 
+    def fit_forecast(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.memory_limit_ratio <= 0:
+            return self.timed_fit_forecast(df)
+        with process_governor(self.memory_limit_ratio).admit(self.name, self.deadline):
+            return self.timed_fit_forecast(df)
+
+    def timed_fit_forecast(self, df: pd.DataFrame) -> pd.DataFrame:
+        start = time.perf_counter()
+        try:
+            return self.fit_forecast0(df)
+        finally:
+            with self.mutex:
+                self.fit_seconds.append(time.perf_counter() - start)
+
+    def fit_forecast0(self, df: pd.DataFrame) -> pd.DataFrame:
+        periods = self.calc_future_period(df)
+        if self.conf.fit_timeout <= 0:
+            return self.engine.forecast(df, periods, self.conf.frequency)
+        try:
+            return forecast_with_timeout(self.engine, df, periods, self.conf.frequency, self.conf.fit_timeout)
+        except FitTimeoutError as e:
+            predict_fit_timeout_count.labels(self.name).inc()
+            logger.warning(f"fit {self.name} timeout, fallback to the seasonal profile: {e}")
+            return self.fallback_engine.forecast(df, periods, self.conf.frequency)
+
+    def predict_clustered(self, metrics: list[ReadyPredictMeter], executor: ThreadPoolExecutor) -> PredictBatchResult:
+        series: dict[tuple[int, Optional[frozenset[LabelKeyValue]]], pd.DataFrame] = {}
+        for inx, meter in enumerate(metrics):
+            if meter.single_df is not None:
+                series[(inx, None)] = meter.single_df
+            elif meter.label_dfs is not None:
+                for labels, df in meter.label_dfs.items():
+                    series[(inx, labels)] = df
+
+        clusters, individual = build_clusters(series, self.conf.cluster, lambda key: (
+            metrics[key[0]].service_name, sorted((kv.key, kv.value) for kv in key[1] or [])))
+        cluster_futures = {}
+        for cluster in clusters:
+            if len(cluster.members) == 1:
+                individual.append(cluster.members[0].key)
+                continue
+            cluster_futures[executor.submit(self.fit_forecast, cluster.training_df())] = cluster
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"cluster {len(cluster_futures)} of {self.name} shared by: "
+                             f"{[(metrics[inx].service_name, labels) for inx, labels in (m.key for m in cluster.members)]}")
+        predict_cluster_fit_count.labels(self.name).inc(len(cluster_futures))
+        cancelled = {member.key for cluster in self.cancel_at_deadline(cluster_futures) for member in cluster.members}
+
+        forecasts: dict[tuple[int, Optional[frozenset[LabelKeyValue]]], pd.DataFrame] = {}
+        for future, cluster in cluster_futures.items():
+            if future.cancelled():
+                continue
+            try:
+                forecast = future.result()
+            except Exception as e:
+                logger.error(f"Error processing cluster of {self.name}, fallback to fit individually: {e}")
+                individual.extend(member.key for member in cluster.members)
+                continue
+            for member in cluster.members:
+                error = cluster.member_error(member, forecast)
+                if error > self.conf.cluster.max_error:
+                    inx, labels = member.key
+                    logger.debug(f"the cluster error of {metrics[inx].service_name}({self.name}), labels: {labels} "
+                                 f"is {error:.4f}, fit individually")
+                    individual.append(member.key)
+                    continue
+                forecasts[member.key] = cluster.member_forecast(member, forecast, error)
+
+        individual_futures = {executor.submit(self.fit_forecast, series[key]): key for key in individual}
+        predict_cluster_individual_fit_count.labels(self.name).inc(len(individual_futures))
+        cancelled.update(self.cancel_at_deadline(individual_futures))
+        for future, key in individual_futures.items():
+            if future.cancelled():
+                continue
+            try:
+                forecasts[key] = future.result()
+            except Exception as e:
+                logger.error(f"Error processing meter: {e}, stacktrace: {"".join(traceback.format_exception(type(e), e, e.__traceback__))}")
+        logger.info(f"total {len(series)} series in the {self.name} fitted with {len(cluster_futures)} cluster models "
+                    f"and {len(individual_futures)} individual models")
+
+        result: list[PredictMeterResult] = []
+        unfinished: list[str] = []
+        for inx, meter in enumerate(metrics):
+            if meter.single_df is not None:
+                if (inx, None) in forecasts:
+                    result.append(meter_to_result(meter, single=forecasts[(inx, None)]))
+                elif (inx, None) in cancelled:
+                    unfinished.append(meter.service_name)
+            elif meter.label_dfs is not None:
+                multiple = {labels: forecasts[(inx, labels)] for labels in meter.label_dfs if (inx, labels) in forecasts}
+                if len(multiple) == len(meter.label_dfs):
+                    result.append(meter_to_result(meter, multiple=multiple))
+                elif any((inx, labels) in cancelled for labels in meter.label_dfs):
+                    unfinished.append(meter.service_name)
+        return PredictBatchResult(result, unfinished)
+
     def calc_future_period(self, df: pd.DataFrame) -> int:
         df_max_time = pd.to_datetime(df['ds'].max())
         future_dates = pd.date_range(start=df_max_time, end=self.future_max_time, freq=self.conf.frequency)
@@ -230,39 +657,52 @@ class PredictService:
             return self.conf.period
         return len(future_dates)
 
+    def should_skip(self, service_name: str) -> bool:
+        if service_name in self.skip_services:
+            return True
+        # never queried services are calculated lazily, after the OAP queried them
+        return self.conf.lazy_unqueried and len(self.priorities) > 0 and service_name not in self.priorities
+
+    def trim_window(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.conf.window_days <= 0:
+            return df
+        return df[df['ds'] > df['ds'].max() - pd.Timedelta(days=self.conf.window_days)]
+
     def split_to_meter(self, data: FetchedData):
+        min_count = self.conf.min_days * 24  # min hours = min_days * 24 hour
         if data.single is not None:
-            service_df = data.df.groupby(data.single.service_name_column)
-            saved_column = {
-                data.single.timestamp_column: 'ds',
-                data.single.value_column: 'y'
-            }
-            for service_name, service_df in service_df:
-                renamed_df = service_df.loc[:, saved_column.keys()].rename(columns=saved_column)
-                renamed_df['ds'] = pd.to_datetime(renamed_df['ds'], format=data.single.time_format)
-                renamed_df = renamed_df.dropna()
-                if len(renamed_df) < self.conf.min_days * 24:  # min hours = min_days * 24 hour
+            frame = compact_series_frame(data.df, data.single.service_name_column, data.single.timestamp_column,
+                                         {data.single.value_column: 'y'}, data.single.time_format).dropna(ignore_index=True)
+            sizes = frame.groupby('service', observed=True).size()
+            values = frame[['ds', 'y']]
+            for service_name, (start, count) in zip(sizes.index, group_ranges(sizes)):
+                if self.should_skip(service_name):
+                    continue
+                if count < min_count:
                     logger.info(f"Skipping {service_name}({self.name}), less than {self.conf.min_days} "
-                                f"days(needs {self.conf.min_days * 24} count) data points(current: {len(renamed_df)})")
+                                f"days(needs {min_count} count) data points(current: {count})")
                     continue
-                yield ReadyPredictMeter(service_name, renamed_df)
+                yield ReadyPredictMeter(service_name, self.trim_window(values.iloc[start:start + count]))
         elif data.multiple is not None:
-            service_df = data.df.groupby(data.multiple.service_name_column)
-            for service_name, service_df in service_df:
+            value_columns = {val_conf.value: val_conf.value for val_conf in data.multiple.value_columns}
+            frame = compact_series_frame(data.df, data.multiple.service_name_column, data.multiple.time_stamp_column,
+                                         value_columns, data.multiple.time_format)
+            grouped = frame.groupby('service', observed=True)
+            sizes = grouped.size()
+            counts = grouped[list(value_columns)].count()
+            for service_name, (start, count) in zip(sizes.index, group_ranges(sizes)):
+                if self.should_skip(service_name):
+                    continue
+                service_values = frame.iloc[start:start + count]
                 service_label_df: dict[frozenset[LabelKeyValue], pd.DataFrame] = {}
                 for val_conf in data.multiple.value_columns:
-                    saved_column = {
-                        data.multiple.time_stamp_column: 'ds',
-                        val_conf.value: 'y'
-                    }
-                    renamed_df = service_df.loc[:, saved_column.keys()].rename(columns=saved_column)
-                    renamed_df['ds'] = pd.to_datetime(renamed_df['ds'], format=data.multiple.time_format)
-                    renamed_df = renamed_df.dropna()
-                    if len(renamed_df) < self.conf.min_days * 24:  # min hours = min_days * 24 hour
+                    label_count = int(counts.at[service_name, val_conf.value])
+                    if label_count < min_count:
                         logger.warning("Skipping %s(%s), labels: %s, less than %d data points(current: %d)" %
-                                       (service_name, self.name, val_conf.tags, self.conf.min_days, len(renamed_df)))
+                                       (service_name, self.name, val_conf.tags, self.conf.min_days, label_count))
                         continue
-                    service_label_df[frozenset(val_conf.tags)] = renamed_df
+                    label_df = pd.DataFrame({'ds': service_values['ds'], 'y': service_values[val_conf.value]}).dropna()
+                    service_label_df[frozenset(val_conf.tags)] = self.trim_window(label_df)
 
                 if len(service_label_df) == 0:
                     logger.warning("Skipping %s(%s), no valid (labels) data points" % (service_name, self.name))
@@ -270,17 +710,42 @@ class PredictService:
                 yield ReadyPredictMeter(service_name, label_dfs=service_label_df)
 
 
+def compact_series_frame(df: pd.DataFrame, service_column: str, timestamp_column: str,
+                         value_columns: dict[str, str], time_format: str) -> pd.DataFrame:
+    """
+    Build the frame with categorical service names, parsed timestamps and float32 values, sorted by service and
+    time, so each service is a contiguous range of rows. The rows without a timestamp are dropped.
+    """
+    frame = pd.DataFrame({
+        'service': df[service_column].astype('category'),
+        'ds': pd.to_datetime(df[timestamp_column], format=time_format),
+    })
+    for source, target in value_columns.items():
+        frame[target] = df[source].astype('float32') if source in df else np.float32('nan')
+    frame = frame[frame['ds'].notna()]
+    return frame.sort_values(['service', 'ds'], kind='stable', ignore_index=True)
+
+
+def group_ranges(sizes: pd.Series) -> list[tuple[int, int]]:
+    counts = sizes.to_numpy()
+    starts = np.cumsum(counts) - counts
+    return [(int(start), int(count)) for start, count in zip(starts, counts)]
+
+
 def calc_max_predict_time(conf: PredictConfig) -> datetime.datetime:
-    freq = conf.frequency.lower()
+    return datetime.datetime.now() + frequency_delta(conf.frequency, conf.period)
+
+
+def frequency_delta(frequency: str, count: int) -> datetime.timedelta:
+    freq = frequency.lower()
     if freq == 'd':
-        return datetime.datetime.now() + datetime.timedelta(days=conf.period)
+        return datetime.timedelta(days=count)
     elif freq == 'h':
-        return datetime.datetime.now() + datetime.timedelta(hours=conf.period)
+        return datetime.timedelta(hours=count)
     elif freq == 't' or freq == 'm':
-        return datetime.datetime.now() + datetime.timedelta(minutes=conf.period)
+        return datetime.timedelta(minutes=count)
     elif freq == 's':
-        return datetime.datetime.now() + datetime.timedelta(seconds=conf.period)
+        return datetime.timedelta(seconds=count)
     elif freq == 'w':
-        return datetime.datetime.now() + datetime.timedelta(weeks=conf.period)
-    raise ValueError(f"Unknown frequency type: {conf.frequency}")
-
+        return datetime.timedelta(weeks=count)
+    raise ValueError(f"Unknown frequency type: {frequency}")
@@ -12,13 +12,17 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
 from concurrent import futures
-
-import pandas as pd
+from typing import Optional
 
 import grpc
+from prometheus_client import Counter
 
+from baseline.access import AccessTracker
 from baseline.fetcher import Fetcher
 from baseline.result import ResultManager, QueryTimeBucketStep
 from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictLabeledWithLabeledValue, \
@@ -31,32 +35,56 @@ from baseline.proto.generated.baseline_pb2_grpc import add_AlarmBaselineServiceS
 
 logger = logging.getLogger(__name__)
 
+prediction_cache_hit_count = Counter('prediction_cache_hit_count',
+                                     'The number of predictions responded from the converted cache', ['name'])
+
 
 class Query:
 
-    def __init__(self, port: int, fetcher: Fetcher, result_manager: ResultManager):
+    def __init__(self, port: int, fetcher: Fetcher, result_manager: ResultManager,
+                 access_tracker: Optional[AccessTracker] = None, prediction_cache_size: int = 0,
+                 query_concurrency: int = 0):
         self.grpc_port = port
         self.fetcher = fetcher
         self.result_manager = result_manager
+        self.access_tracker = access_tracker
+        self.prediction_cache_size = prediction_cache_size
+        self.query_concurrency = query_concurrency if query_concurrency > 0 else result_manager.query_concurrency
 
     async def serve(self):
-        server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
+        # the handlers are all async, the server needs no thread pool of its own, the results are read in the
+        # query executor only, so the event loop is never blocked by the storage
+        server = grpc.aio.server()
 
         server.add_insecure_port('[::]:%s' % self.grpc_port)
-        add_AlarmBaselineServiceServicer_to_server(BaselineQueryServer(self.fetcher, self.result_manager), server)
+        query_executor = futures.ThreadPoolExecutor(max_workers=self.query_concurrency,
+                                                    thread_name_prefix='baseline-query')
+        add_AlarmBaselineServiceServicer_to_server(
+            BaselineQueryServer(self.fetcher, self.result_manager, self.access_tracker,
+                                PredictionCache(self.prediction_cache_size) if self.prediction_cache_size > 0 else None,
+                                query_executor),
+            server)
 
         await server.start()
 
-        logger.info('gRPC Server started at :%s' % self.grpc_port)
+        logger.info('gRPC Server started at :%s, query concurrency: %s' % (self.grpc_port, self.query_concurrency))
 
-        await server.wait_for_termination()
+        try:
+            await server.wait_for_termination()
+        finally:
+            query_executor.shutdown(wait=False)
 
 
 class BaselineQueryServer(AlarmBaselineServiceServicer):
 
-    def __init__(self, fetcher: Fetcher, result_manager: ResultManager):
+    def __init__(self, fetcher: Fetcher, result_manager: ResultManager, access_tracker: Optional[AccessTracker] = None,
+                 prediction_cache: Optional["PredictionCache"] = None,
+                 query_executor: Optional[futures.Executor] = None):
         self.result_manager = result_manager
         self.support_metrics_names = fetcher.metric_names()
+        self.access_tracker = access_tracker
+        self.prediction_cache = prediction_cache
+        self.query_executor = query_executor
 
     async def querySupportedMetricsNames(self, request, context):
         logger.info('receive query supported metrics names query')
@@ -79,27 +107,26 @@ class BaselineQueryServer(AlarmBaselineServiceServicer):
             } for service_metrics in request.serviceMetricNames]
             logger.debug(f"total service with metrics ready to query: {info}")
 
-        results: dict[str, dict[str, list[PredictMeterResult]]] = {}
-        for serviceWithMetrics in request.serviceMetricNames:
-            predict_metrics = self.result_manager.query(serviceWithMetrics.serviceName,
-                                                        list(serviceWithMetrics.metricNames),
-                                                        request.startTimeBucket, request.endTimeBucket,
-                                                        convert_query_time_bucket_step(request.step))
-            for metric_name, result in predict_metrics.items():
-                if serviceWithMetrics.serviceName not in results:
-                    results[serviceWithMetrics.serviceName] = {}
-                metrics_vals = results[serviceWithMetrics.serviceName]
-                if metric_name not in metrics_vals:
-                    metrics_vals[metric_name] = []
-                metric_val = metrics_vals[metric_name]
-                for r in result:
-                    metric_val.append(r)
+        if self.access_tracker is not None:
+            for serviceWithMetrics in request.serviceMetricNames:
+                self.access_tracker.record(serviceWithMetrics.serviceName,
+                                           service_must_contains_metrics[serviceWithMetrics.serviceName])
+
+        # the services are queried concurrently, bounded by the workers of the query executor
+        loop = asyncio.get_running_loop()
+        service_predictions = await asyncio.gather(*[
+            loop.run_in_executor(self.query_executor, self.query_service, serviceWithMetrics.serviceName,
+                                 list(serviceWithMetrics.metricNames), request.startTimeBucket,
+                                 request.endTimeBucket, request.step)
+            for serviceWithMetrics in request.serviceMetricNames])
+        results: dict[str, dict[str, AlarmBaselineMetricPrediction]] = {}
+        for serviceWithMetrics, predictions in zip(request.serviceMetricNames, service_predictions):
+            if predictions:
+                results[serviceWithMetrics.serviceName] = predictions
 
         serviceMetrics: list[AlarmBaselineServiceMetric] = []
-        for service, metricsWithPredictValues in results.items():
-            predictions = []
-            for metric_name, result in metricsWithPredictValues.items():
-                predictions.append(convert_response_metrics(service, metric_name, result, request.step))
+        for service, metricsWithPredictions in results.items():
+            predictions = list(metricsWithPredictions.values())
 
             # if the predict metrics count not equals the request metrics count, we need to ignore it
             if len(service_must_contains_metrics[service]) != len(predictions):
@@ -112,6 +139,68 @@ class BaselineQueryServer(AlarmBaselineServiceServicer):
 
         return AlarmBaselineResponse(serviceMetrics=serviceMetrics)
 
+    def query_service(self, service: str, metric_names: list[str], start_bucket: int, end_bucket: int,
+                      step: TimeBucketStep) -> dict[str, AlarmBaselineMetricPrediction]:
+        """
+        Query and convert the predictions of the service, blocking on the storage, so it runs in the query executor.
+        """
+        predictions: dict[str, AlarmBaselineMetricPrediction] = {}
+        updated_times: dict[str, Optional[float]] = {}
+        if self.prediction_cache is not None:
+            for metric_name in metric_names:
+                updated_times[metric_name] = self.result_manager.updated_time(metric_name)
+                prediction = self.prediction_cache.get((service, metric_name, start_bucket, end_bucket, step),
+                                                       updated_times[metric_name])
+                if prediction is not None:
+                    predictions[metric_name] = prediction
+        uncached_metrics = [metric_name for metric_name in metric_names if metric_name not in predictions]
+        predict_metrics = self.result_manager.query(service, uncached_metrics, start_bucket, end_bucket,
+                                                    convert_query_time_bucket_step(step)) if uncached_metrics else {}
+        for metric_name, result in predict_metrics.items():
+            prediction = convert_response_metrics(service, metric_name, result, step)
+            predictions[metric_name] = prediction
+            if self.prediction_cache is not None and prediction is not None:
+                self.prediction_cache.put((service, metric_name, start_bucket, end_bucket, step),
+                                          updated_times.get(metric_name), prediction)
+        return predictions
+
+
+class PredictionCache:
+    """
+    Cache the converted predictions by the service, metric and the time range of the query. The predictions of a
+    metric are invalidated when the updated time of the metric changed, the least recently used are evicted when
+    exceeding the max size.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict[tuple, tuple[float, AlarmBaselineMetricPrediction]] = OrderedDict()
+        self.mutex = threading.Lock()
+
+    def get(self, key: tuple, updated: Optional[float]) -> Optional[AlarmBaselineMetricPrediction]:
+        if updated is None:
+            return None
+        with self.mutex:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != updated:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        prediction_cache_hit_count.labels(key[1]).inc()
+        return entry[1]
+
+    def put(self, key: tuple, updated: Optional[float], prediction: AlarmBaselineMetricPrediction):
+        # the updated time is read before querying, the predictions saved while querying are converted next time
+        if updated is None:
+            return
+        with self.mutex:
+            self.entries[key] = (updated, prediction)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
 
 def convert_query_time_bucket_step(step: TimeBucketStep) -> QueryTimeBucketStep:
     if step == TimeBucketStep.HOUR:
@@ -139,7 +228,7 @@ def convert_response_single_value(values: list[PredictTimestampWithSingleValue],
     count = 0
     for value in values:
         result.append(AlarmBaselinePredicatedValue(
-            timeBucket=convert_response_time_bucket(value.timestamp, step),
+            timeBucket=convert_response_time_bucket(value, step),
             singleValue=AlarmBaselineSingleValue(
                 value=AlarmBaselineValue(
                     value=int(value.value.value),
@@ -169,7 +258,7 @@ def convert_response_multiple_value(values: list[PredictLabeledWithLabeledValue]
     for val in values:
         labels = convert_response_labels(val.label)
         for time_with_value in val.time_with_values:
-            time_bucket = convert_response_time_bucket(time_with_value.timestamp, step)
+            time_bucket = convert_response_time_bucket(time_with_value, step)
             if time_bucket not in time_values:
                 time_values[time_bucket] = []
             time_values[time_bucket].append(AlarmBaselineLabeledValue.LabelWithValue(
@@ -198,9 +287,9 @@ def convert_response_multiple_value(values: list[PredictLabeledWithLabeledValue]
     return result
 
 
-def convert_response_time_bucket(ts: pd.Timestamp, step: TimeBucketStep) -> int:
+def convert_response_time_bucket(value: PredictTimestampWithSingleValue, step: TimeBucketStep) -> int:
     if step == TimeBucketStep.HOUR:
-        return int(ts.strftime('%Y%m%d%H'))
+        return value.time_bucket
     return 0
 
 
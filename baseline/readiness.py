@@ -0,0 +1,93 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from prometheus_client import Gauge
+
+from baseline.calculate import Calculator
+from baseline.result import ResultManager
+
+logger = logging.getLogger(__name__)
+
+result_age_seconds = Gauge('result_age_seconds', 'The seconds since the baseline results of the metric saved', ['name'],
+                           multiprocess_mode='liveall')
+
+
+class Readiness:
+    """
+    Report whether the baseline is ready to be served. It is ready when all metrics have the saved results(no older
+    than the max age minutes if configured), or the first calculation since startup finished.
+    """
+
+    def __init__(self, saver: ResultManager, metric_names: list[str], calculator: Calculator, max_age: int = 0):
+        self.saver = saver
+        self.metric_names = metric_names
+        self.calculator = calculator
+        self.max_age = max_age
+
+    def status(self) -> tuple[bool, dict]:
+        now = time.time()
+        ages: dict[str, Optional[float]] = {}
+        for meter in self.metric_names:
+            updated = self.saver.updated_time(meter)
+            ages[meter] = None if updated is None else now - updated
+            if updated is not None:
+                result_age_seconds.labels(meter).set(ages[meter])
+        calculated = self.calculator.last_finished is not None
+        fresh = all(age is not None and (self.max_age <= 0 or age <= self.max_age * 60) for age in ages.values())
+        return calculated or fresh, {
+            'calculated': calculated,
+            'last_calculated': self.calculator.last_finished,
+            'metrics': {meter: None if age is None else round(age, 3) for meter, age in ages.items()},
+        }
+
+
+class ReadinessServer:
+    """
+    Serve the readiness by HTTP, `GET /ready` responds 200 when ready or 503 otherwise, with the freshness of the
+    results of each metric in seconds.
+    """
+
+    def __init__(self, port: int, readiness: Readiness):
+        self.port = port
+        self.readiness = readiness
+
+    def start(self):
+        readiness = self.readiness
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/ready':
+                    self.send_error(404)
+                    return
+                ready, detail = readiness.status()
+                body = json.dumps({'ready': ready, **detail}).encode('utf-8')
+                self.send_response(200 if ready else 503)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        server = ThreadingHTTPServer(('', self.port), Handler)
+        threading.Thread(target=server.serve_forever, name='readiness-server', daemon=True).start()
+        logger.info(f"Readiness server started at :{self.port}")
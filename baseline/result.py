@@ -12,25 +12,51 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import calendar
+import contextlib
+import fcntl
 import json
 import logging
 import os
+import queue
+import re
+import tempfile
+import threading
+import time
 from abc import abstractmethod, ABC
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from enum import Enum
+from typing import Container, Optional
 
 import pandas as pd
+from prometheus_client import Counter
 
-from baseline.predict import PredictMeterResult
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, predict_pipeline_queue_size
 
 log = logging.getLogger(__name__)
 
+result_cache_hit_count = Counter('result_cache_hit_count', 'The number of queries served by the cached results', ['name'])
+result_cache_miss_count = Counter('result_cache_miss_count', 'The number of results loaded into the cache', ['name'])
+
+# the temporary files older than it are left by the crashed savings
+temp_file_grace_seconds = 60
+# read once at the import, changing the umask to read it is not thread safe
+process_umask = os.umask(0o022)
+os.umask(process_umask)
+
+# the approximate memory of a decoded result point, including the timestamp and the values
+result_point_bytes = 400
+
 
 class QueryTimeBucketStep(Enum):
     HOUR = 1
 
 
 class ResultManager(ABC):
+    # the default number of concurrent queries, the storages parsing in Python are limited by the GIL
+    query_concurrency: int = 4
+    # whether the update only writes the given services, otherwise the whole metric is loaded and saved again
+    incremental_update: bool = False
 
     @abstractmethod
     def save(self, meter_name: str, results: list[PredictMeterResult]):
@@ -41,6 +67,41 @@ class ResultManager(ABC):
               step: QueryTimeBucketStep) -> dict[str, list[PredictMeterResult]]:
         pass
 
+    @abstractmethod
+    def load(self, meter_name: str) -> list[PredictMeterResult]:
+        pass
+
+    def updated_time(self, meter_name: str) -> Optional[float]:
+        """
+        The timestamp in seconds of the last saving of the metric, None means no results saved.
+        """
+        return None
+
+    def lock(self, meter_name: str):
+        """
+        Exclusive access to the results of the metric, across the threads and processes.
+        """
+        return contextlib.nullcontext()
+
+    def refresh(self, meter_name: str):
+        """
+        Notify the results of the metric are saved, maybe by another process.
+        """
+        pass
+
+    def update(self, meter_name: str, results: list[PredictMeterResult], retain: Optional[set[str]] = None,
+               scope: Optional[Container[str]] = None):
+        """
+        Replace the results of the given services. The stored results of the other services are kept,
+        or only kept when in the retain service names if it is not None. The services out of the scope are
+        always kept, the scope None means all services.
+        """
+        with self.lock(meter_name):
+            updated = {result.service_name for result in results}
+            kept = [result for result in self.load(meter_name) if result.service_name not in updated and
+                    is_retained(result.service_name, retain, scope)]
+            self.save(meter_name, results + kept)
+
 
 class MeterNameResultManager(ResultManager):
 
@@ -53,23 +114,24 @@ class MeterNameResultManager(ResultManager):
             grouped_results[result.service_name] = result
         file_name = f"{self.dir}/{meter_name}.json"
         os.makedirs(os.path.dirname(file_name), exist_ok=True)
-        with open(file_name, 'w', encoding='utf-8') as f:
+        # the readers still see the complete previous file until it is replaced
+        with atomic_file(file_name) as f:
             json.dump(grouped_results, f, ensure_ascii=False, separators=(',', ':'), cls=ResultEncoder)
+        remove_stale_temp_files(self.dir, meter_name)
 
     def query(self, service_name: str, metrics_names: list[str], start_bucket: int, end_bucket: int,
               step: QueryTimeBucketStep) -> dict[str, list[PredictMeterResult]]:
         results: dict[str, list[PredictMeterResult]] = {}
-        startTs, endTs = time_bucket_to_timestamp(start_bucket, step), time_bucket_to_timestamp(end_bucket, step)
         for meter_name in metrics_names:
             file_name = f"{self.dir}/{meter_name}.json"
             if os.path.exists(file_name):
                 with open(file_name, 'r', encoding='utf-8') as f:
                     try:
                         file_content = f.read()
-                        data = json.loads(file_content, object_hook=json_load_object_hook)
+                        data = json.loads(file_content)
                         if service_name in data:
                             service_results = PredictMeterResult.from_dict(data[service_name])
-                            service_results.filter_time(startTs, endTs)
+                            service_results.filter_time(start_bucket, end_bucket)
                             if meter_name not in results:
                                 results[meter_name] = []
                             results[meter_name].append(service_results)
@@ -79,12 +141,247 @@ class MeterNameResultManager(ResultManager):
                 log.info(f"cannot found the baseline result file: filepath: {file_name}")
         return results
 
+    def updated_time(self, meter_name: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(f"{self.dir}/{meter_name}.json")
+        except OSError:
+            return None
+
+    def lock(self, meter_name: str):
+        return file_lock(self.dir, meter_name)
+
+    def load(self, meter_name: str) -> list[PredictMeterResult]:
+        file_name = f"{self.dir}/{meter_name}.json"
+        if not os.path.exists(file_name):
+            return []
+        with open(file_name, 'r', encoding='utf-8') as f:
+            try:
+                data = json.loads(f.read())
+                return [PredictMeterResult.from_dict(result) for result in data.values()]
+            except json.JSONDecodeError as e:
+                log.error(f"parsing baseline result file failure, filepath: {file_name}, error: {e}")
+                return []
+
+
+class CachedResults:
+    def __init__(self, updated: float, results: dict[str, PredictMeterResult]):
+        self.updated = updated
+        self.results = results
+        self.size = sum(result.points() for result in results.values()) * result_point_bytes
+
+
+class CachedResultManager(ResultManager):
+    """
+    Cache the decoded results of the delegated manager in memory by the metric, the least recently used metrics are
+    evicted when exceeding the max bytes. The cached results are invalidated when the updated time of the metric
+    changed, so the results saved by the other processes are reloaded, and reloaded right after refreshed.
+    """
+
+    def __init__(self, delegate: ResultManager, max_bytes: int):
+        self.delegate = delegate
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, CachedResults] = OrderedDict()
+        self.size = 0
+        self.mutex = threading.Lock()
+
+    def __getstate__(self):
+        # the worker processes only save the results, the cache is not shared with them
+        return {'delegate': self.delegate, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['delegate'], state['max_bytes'])
+
+    @property
+    def query_concurrency(self) -> int:
+        return self.delegate.query_concurrency
+
+    @property
+    def incremental_update(self) -> bool:
+        return self.delegate.incremental_update
+
+    def save(self, meter_name: str, results: list[PredictMeterResult]):
+        self.delegate.save(meter_name, results)
+        self.invalidate(meter_name)
+
+    def query(self, service_name: str, metrics_names: list[str], start_bucket: int, end_bucket: int,
+              step: QueryTimeBucketStep) -> dict[str, list[PredictMeterResult]]:
+        results: dict[str, list[PredictMeterResult]] = {}
+        for meter_name in metrics_names:
+            service_results = self.cached(meter_name).get(service_name)
+            if service_results is not None:
+                results[meter_name] = [service_results.time_range(start_bucket, end_bucket)]
+        return results
+
+    def load(self, meter_name: str) -> list[PredictMeterResult]:
+        # the loaded results might be modified by the caller, never share the cached ones
+        return self.delegate.load(meter_name)
+
+    def updated_time(self, meter_name: str) -> Optional[float]:
+        return self.delegate.updated_time(meter_name)
+
+    def lock(self, meter_name: str):
+        return self.delegate.lock(meter_name)
+
+    def refresh(self, meter_name: str):
+        self.delegate.refresh(meter_name)
+        self.cached(meter_name)
+
+    def cached(self, meter_name: str) -> dict[str, PredictMeterResult]:
+        updated = self.delegate.updated_time(meter_name)
+        with self.mutex:
+            entry = self.entries.get(meter_name)
+            if entry is not None and updated is not None and entry.updated == updated:
+                self.entries.move_to_end(meter_name)
+                result_cache_hit_count.labels(meter_name).inc()
+                return entry.results
+        result_cache_miss_count.labels(meter_name).inc()
+        # the updated time is read before loading, the results saved while loading are reloaded next time
+        entry = CachedResults(updated, {result.service_name: result for result in self.delegate.load(meter_name)})
+        if updated is None:
+            return entry.results
+        with self.mutex:
+            self.remove(meter_name)
+            if entry.size > self.max_bytes:
+                log.warning(f"the results of {meter_name} are too large to be cached, size: {entry.size} bytes")
+                return entry.results
+            while self.size + entry.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+            self.entries[meter_name] = entry
+            self.size += entry.size
+        return entry.results
+
+    def invalidate(self, meter_name: str):
+        with self.mutex:
+            self.remove(meter_name)
+
+    def remove(self, meter_name: str):
+        entry = self.entries.pop(meter_name, None)
+        if entry is not None:
+            self.size -= entry.size
+
+
+class StreamingResultWriter:
+    """
+    Save the results of a metric while it is still being calculated. The results are buffered in a bounded queue,
+    the put is blocked when the queue is full, so the memory is bounded by the queue size. The writer thread
+    merges all buffered results into the stored results at once, they are queryable after each write.
+    Only for the savers with the incremental update, otherwise each write rewrites the whole metric.
+    """
+
+    def __init__(self, saver: ResultManager, meter_name: str, queue_size: int):
+        self.saver = saver
+        self.meter_name = meter_name
+        self.queue: queue.Queue[Optional[PredictMeterResult]] = queue.Queue(maxsize=queue_size)
+        self.queue_size = predict_pipeline_queue_size.labels(meter_name, 'save')
+        self.thread = threading.Thread(target=self.write_loop, name=f"result-writer-{meter_name}", daemon=True)
+        self.thread.start()
+
+    def put(self, result: PredictMeterResult):
+        self.queue.put(result)
+        self.queue_size.inc()
 
-def time_bucket_to_timestamp(bucket: int, step: QueryTimeBucketStep) -> pd.Timestamp:
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def write_loop(self):
+        closed = False
+        while not closed:
+            results = []
+            item = self.queue.get()
+            while True:
+                if item is None:
+                    closed = True
+                    break
+                results.append(item)
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if not results:
+                continue
+            self.queue_size.dec(len(results))
+            try:
+                self.saver.update(self.meter_name, results)
+                log.debug(f"saved {len(results)} results of {self.meter_name}")
+            except Exception as e:
+                log.error(f"saving {len(results)} results of {self.meter_name} failure: {e}")
+
+
+def is_retained(service_name: str, retain: Optional[set[str]], scope: Optional[Container[str]]) -> bool:
+    return retain is None or service_name in retain or (scope is not None and service_name not in scope)
+
+
+@contextlib.contextmanager
+def file_lock(dir: str, meter_name: str):
+    os.makedirs(dir, exist_ok=True)
+    with open(f"{dir}/{meter_name}.lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def atomic_file(file_name: str):
+    """
+    Write a temporary file in the same directory, then replace the file by it after flushed to the disk.
+    The file is kept unchanged when the writing failure.
+    """
+    dir_name, base_name = os.path.split(file_name)
+    fd, tmp = tempfile.mkstemp(dir=dir_name, prefix=f".{base_name}.", suffix='.tmp')
+    try:
+        # the temporary file is only readable by the owner, keep the permission of a file created by open()
+        os.chmod(tmp, 0o666 & ~process_umask)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, file_name)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def remove_stale_temp_files(dir: str, meter_name: str):
+    pattern = re.compile(rf"\.{re.escape(meter_name)}\.[^.]+\.[^.]+\.tmp")
+    expired = time.time() - temp_file_grace_seconds
+    for entry in os.scandir(dir):
+        if not pattern.fullmatch(entry.name):
+            continue
+        try:
+            if entry.stat().st_mtime < expired:
+                os.remove(entry.path)
+        except OSError as e:
+            log.warning(f"removing the stale temporary file {entry.name} failure: {e}")
+
+
+def create_result_manager(storage: str, dir: str) -> ResultManager:
+    name = storage.lower()
+    if name == 'json':
+        return MeterNameResultManager(dir)
+    elif name == 'columnar':
+        from baseline.columnar import ColumnarResultManager
+        return ColumnarResultManager(dir)
+    elif name == 'sqlite':
+        from baseline.sqlite import SQLiteResultManager
+        return SQLiteResultManager(dir)
+    raise ValueError(f"Unknown result storage: {storage}")
+
+
+def time_bucket_to_nanos(bucket: int, step: QueryTimeBucketStep) -> int:
+    """
+    The nanoseconds of the naive timestamp of the time bucket, same as the `pd.Timestamp.value`.
+    """
     if step == QueryTimeBucketStep.HOUR:
-        return pd.to_datetime(f"{bucket}", format="%Y%m%d%H")
+        date, hour = divmod(bucket, 100)
+        date, day = divmod(date, 100)
+        year, month = divmod(date, 100)
+        return calendar.timegm((year, month, day, hour, 0, 0)) * 1_000_000_000
     log.warning(f"detect the time bucket query is not hour, baseline is not support for now, current: {step}")
-    return pd.Timestamp(0)
+    return 0
 
 
 class ResultEncoder(json.JSONEncoder):
@@ -93,12 +390,9 @@ class ResultEncoder(json.JSONEncoder):
             return list(obj)
         if isinstance(obj, pd.Timestamp):
             return obj.isoformat()
+        if isinstance(obj, PredictTimestampWithSingleValue):
+            return {'timestamp': obj.timestamp, 'value': obj.value, 'time_bucket': obj.time_bucket}
         if hasattr(obj, '__dict__'):
             return obj.__dict__
         return super().default(obj)
 
-
-def json_load_object_hook(dct):
-    if 'timestamp' in dct:
-        dct['timestamp'] = pd.to_datetime(dct['timestamp'])
-    return dct
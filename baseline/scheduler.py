@@ -12,35 +12,89 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import datetime
 import logging
+from typing import Optional
 
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, JobSubmissionEvent
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 
-from baseline.calculate import Calculator
+from baseline.access import AccessTracker
+from baseline.calculate import Calculator, WorkerConfig, calculate_skipped_cycle_count
+from baseline.correct import CorrectionConfig, Corrector
 from baseline.fetcher import Fetcher
+from baseline.lease import Coordinator
 from baseline.predict import PredictConfig
 from baseline.result import ResultManager
 
 logger = logging.getLogger(__name__)
 
+# the ratio of the interval to the next execution used by the calculation, the rest is left for saving
+cycle_deadline_ratio = 0.9
+
 
 class Scheduler:
-    def __init__(self, cron: str, conf: PredictConfig, fetcher: Fetcher, saver: ResultManager):
+    def __init__(self, cron: str, conf: PredictConfig, fetcher: Fetcher, saver: ResultManager,
+                 access_tracker: Optional[AccessTracker] = None, correction: Optional[CorrectionConfig] = None,
+                 worker: Optional[WorkerConfig] = None, coordinator: Optional[Coordinator] = None):
         self.cron = cron
         self.conf = conf
         self.fetcher = fetcher
         self.saver = saver
+        self.calculator = Calculator(conf, fetcher, saver, access_tracker, worker, coordinator)
+        self.corrector = Corrector(self.calculator, correction) if correction is not None else None
+        self.trigger = CronTrigger.from_crontab(cron)
+        self.job_id: Optional[str] = None
 
     def start(self):
+        """
+        Start the scheduler without blocking, the first calculation runs in the background immediately, the existing
+        results are served in the meantime.
+        """
         logger.info("Starting the dynamic baseline scheduler")
-        Calculator(self.conf, self.fetcher, self.saver).start()
         scheduler = BackgroundScheduler()
-        trigger = CronTrigger.from_crontab(self.cron)
-        scheduler.add_job(self.run_job, trigger)
+        self.job_id = scheduler.add_job(self.run_job, self.trigger, max_instances=1, coalesce=True).id
+        # the execution is dropped by the scheduler while the previous one is still running
+        scheduler.add_listener(self.on_max_instances, EVENT_JOB_MAX_INSTANCES)
+        scheduler.add_job(self.run_job, kwargs={'startup': True})
+        if self.corrector is not None and self.corrector.conf.interval > 0:
+            scheduler.add_job(self.run_correct_job, IntervalTrigger(minutes=self.corrector.conf.interval))
         scheduler.start()
 
-    def run_job(self):
+    def on_max_instances(self, event: JobSubmissionEvent):
+        if event.job_id != self.job_id:
+            return
+        logger.warning("The previous baseline calculation is still running, skip this one")
+        calculate_skipped_cycle_count.inc()
+
+    def run_job(self, startup: bool = False):
         logger.info("Running the baseline calculation job")
-        Calculator(self.conf, self.fetcher, self.saver).start()
+        now = datetime.datetime.now(self.trigger.timezone)
+        end_time = self.cycle_end_time(now, startup)
+        self.calculator.start(self.cycle_deadline(now, end_time), self.cycle_id(end_time))
+
+    def cycle_end_time(self, now: datetime.datetime, startup: bool = False) -> Optional[datetime.datetime]:
+        """
+        The calculation runs until the next execution. The startup calculation might start right before the next
+        execution, it runs until the execution after the next instead, which is skipped as the calculation is still
+        running, so it always has a full interval.
+        """
+        next_time = self.trigger.get_next_fire_time(None, now)
+        if next_time is None or not startup:
+            return next_time
+        return self.trigger.get_next_fire_time(next_time, next_time + datetime.timedelta(microseconds=1)) or next_time
+
+    def cycle_deadline(self, now: datetime.datetime, end_time: Optional[datetime.datetime]) -> Optional[float]:
+        if end_time is None:
+            return None
+        return now.timestamp() + (end_time.timestamp() - now.timestamp()) * cycle_deadline_ratio
+
+    def cycle_id(self, end_time: Optional[datetime.datetime]) -> Optional[str]:
+        # all replicas running before the same execution are in the same cycle
+        return None if end_time is None else str(int(end_time.timestamp()))
 
+    def run_correct_job(self):
+        logger.info("Running the baseline correction job")
+        self.corrector.start()
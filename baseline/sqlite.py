@@ -0,0 +1,214 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import contextlib
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Container, Optional, Iterable
+
+import numpy as np
+import pandas as pd
+
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictValue, \
+    PredictLabeledWithLabeledValue, LabelKeyValue, nanos_to_time_buckets
+from baseline.result import ResultManager, QueryTimeBucketStep, time_bucket_to_nanos, file_lock, is_retained
+
+log = logging.getLogger(__name__)
+
+database_file = 'results.db'
+# the label of the single value rows
+single_label = ''
+# the seconds to wait for the writing of the other connections
+busy_timeout = 30
+
+schema = [
+    # the rows are clustered by the primary key, so a time range of a series is read continuously from the table
+    '''CREATE TABLE IF NOT EXISTS result_values (
+        metric TEXT NOT NULL,
+        service TEXT NOT NULL,
+        label TEXT NOT NULL,
+        time_bucket INTEGER NOT NULL,
+        value REAL,
+        upper REAL,
+        lower REAL,
+        PRIMARY KEY (metric, service, label, time_bucket)
+    ) WITHOUT ROWID''',
+    # keep whether the service has the single and the labeled results, even without any value
+    '''CREATE TABLE IF NOT EXISTS result_services (
+        metric TEXT NOT NULL,
+        service TEXT NOT NULL,
+        has_single INTEGER NOT NULL,
+        has_labeled INTEGER NOT NULL,
+        PRIMARY KEY (metric, service)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS result_metrics (
+        metric TEXT PRIMARY KEY,
+        updated REAL NOT NULL
+    )''',
+]
+
+
+class SQLiteResultManager(ResultManager):
+    """
+    Store the results in a SQLite database in the WAL mode, the values are keyed by the metric, service, label and
+    time bucket. The results of the services are upserted in a transaction, and the query only reads the rows of the
+    service in the time range, the readers are never blocked by the writing.
+    """
+
+    # sqlite releases the GIL while reading, each thread has its own connection
+    query_concurrency = 8
+    incremental_update = True
+
+    def __init__(self, dir: str):
+        self.dir = dir
+        self.file_name = f"{dir}/{database_file}"
+        self.local = threading.local()
+
+    def __getstate__(self):
+        # the connections cannot be shared across the processes
+        return {'dir': self.dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['dir'])
+
+    def save(self, meter_name: str, results: list[PredictMeterResult]):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM result_values WHERE metric = ?', (meter_name,))
+            conn.execute('DELETE FROM result_services WHERE metric = ?', (meter_name,))
+            self.insert(conn, meter_name, results)
+
+    def update(self, meter_name: str, results: list[PredictMeterResult], retain: Optional[set[str]] = None,
+               scope: Optional[Container[str]] = None):
+        # the file lock excludes the load-modify-save of the other callers holding the lock
+        with self.lock(meter_name), self.transaction() as conn:
+            if retain is not None:
+                kept = retain | {result.service_name for result in results}
+                removed = [service for service in self.service_names(conn, meter_name)
+                           if not is_retained(service, kept, scope)]
+                self.delete_services(conn, meter_name, removed)
+            self.delete_services(conn, meter_name, [result.service_name for result in results])
+            self.insert(conn, meter_name, results)
+
+    def query(self, service_name: str, metrics_names: list[str], start_bucket: int, end_bucket: int,
+              step: QueryTimeBucketStep) -> dict[str, list[PredictMeterResult]]:
+        results: dict[str, list[PredictMeterResult]] = {}
+        start = time_bucket_to_nanos(start_bucket, step)
+        end = time_bucket_to_nanos(end_bucket, step)
+        conn = self.connection()
+        for meter_name in metrics_names:
+            service = conn.execute('SELECT has_single, has_labeled FROM result_services '
+                                   'WHERE metric = ? AND service = ?', (meter_name, service_name)).fetchone()
+            if service is None:
+                log.info(f"cannot found the baseline result of {meter_name}, service: {service_name}")
+                continue
+            rows = conn.execute('SELECT label, time_bucket, value, upper, lower FROM result_values '
+                                'WHERE metric = ? AND service = ? AND time_bucket BETWEEN ? AND ? '
+                                'ORDER BY label, time_bucket', (meter_name, service_name, start, end))
+            results[meter_name] = [build_result(service_name, service[0], service[1], rows)]
+        return results
+
+    def load(self, meter_name: str) -> list[PredictMeterResult]:
+        conn = self.connection()
+        services = conn.execute('SELECT service, has_single, has_labeled FROM result_services WHERE metric = ? '
+                                'ORDER BY service', (meter_name,)).fetchall()
+        rows = conn.execute('SELECT service, label, time_bucket, value, upper, lower FROM result_values '
+                            'WHERE metric = ? ORDER BY service, label, time_bucket', (meter_name,))
+        grouped = {service: [row[1:] for row in service_rows]
+                   for service, service_rows in itertools.groupby(rows, key=lambda row: row[0])}
+        return [build_result(service, has_single, has_labeled, grouped.get(service, []))
+                for service, has_single, has_labeled in services]
+
+    def updated_time(self, meter_name: str) -> Optional[float]:
+        row = self.connection().execute('SELECT updated FROM result_metrics WHERE metric = ?',
+                                        (meter_name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def lock(self, meter_name: str):
+        return file_lock(self.dir, meter_name)
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(self.dir, exist_ok=True)
+            conn = sqlite3.connect(self.file_name, timeout=busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in schema:
+                conn.execute(statement)
+            self.local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def service_names(self, conn: sqlite3.Connection, meter_name: str) -> list[str]:
+        return [row[0] for row in conn.execute('SELECT service FROM result_services WHERE metric = ?', (meter_name,))]
+
+    def delete_services(self, conn: sqlite3.Connection, meter_name: str, services: list[str]):
+        conn.executemany('DELETE FROM result_values WHERE metric = ? AND service = ?',
+                         [(meter_name, service) for service in services])
+        conn.executemany('DELETE FROM result_services WHERE metric = ? AND service = ?',
+                         [(meter_name, service) for service in services])
+
+    def insert(self, conn: sqlite3.Connection, meter_name: str, results: list[PredictMeterResult]):
+        conn.executemany('INSERT OR REPLACE INTO result_services VALUES (?, ?, ?, ?)',
+                         [(meter_name, result.service_name, result.single is not None, result.labeled is not None)
+                          for result in results])
+        conn.executemany('INSERT OR REPLACE INTO result_values VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         (row for result in results for row in result_rows(meter_name, result)))
+        conn.execute('INSERT OR REPLACE INTO result_metrics VALUES (?, ?)', (meter_name, time.time()))
+
+
+def result_rows(meter_name: str, result: PredictMeterResult) -> Iterable[tuple]:
+    groups = [(single_label, result.single or [])]
+    groups.extend((encode_label(labeled.label), labeled.time_with_values) for labeled in result.labeled or [])
+    for label, points in groups:
+        for point in points:
+            yield (meter_name, result.service_name, label, pd.Timestamp(point.timestamp).value,
+                   point.value.value, point.value.upper_value, point.value.lower_value)
+
+
+def build_result(service_name: str, has_single: bool, has_labeled: bool, rows: Iterable[tuple]) -> PredictMeterResult:
+    single, labeled = ([] if has_single else None), ([] if has_labeled else None)
+    for label, label_rows in itertools.groupby(rows, key=lambda row: row[0]):
+        label_rows = list(label_rows)
+        buckets = nanos_to_time_buckets(np.array([row[1] for row in label_rows], dtype=np.int64)).tolist()
+        values = [PredictTimestampWithSingleValue(ts, PredictValue(value, upper, lower), bucket)
+                  for (_, ts, value, upper, lower), bucket in zip(label_rows, buckets)]
+        if label == single_label:
+            single = values
+        else:
+            labeled.append(PredictLabeledWithLabeledValue(decode_label(label), values))
+    return PredictMeterResult(service_name, single, labeled)
+
+
+def encode_label(label: frozenset[LabelKeyValue]) -> str:
+    return json.dumps(sorted([kv.key, kv.value] for kv in label), ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_label(label: str) -> frozenset[LabelKeyValue]:
+    return frozenset(LabelKeyValue(k, v) for k, v in json.loads(label))
@@ -0,0 +1,142 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import argparse
+import logging
+import os
+import shutil
+import time
+from typing import Optional
+
+import numpy as np
+
+from baseline.calculate import Calculator, WorkerConfig
+from baseline.fetcher import Fetcher, FetchedData, GraphQLFetcher
+from baseline.lease import Coordinator, FileLeaseManager
+from baseline.predict import PredictConfig, PredictStats
+from baseline.result import create_result_manager
+from server.server import build_predict_config, current_config
+
+logger = logging.getLogger(__name__)
+
+backfill_cycle = 'backfill'
+
+
+class SelectedFetcher(Fetcher):
+    """
+    Only fetch the selected metrics and services of the delegated fetcher.
+    """
+
+    def __init__(self, fetcher: Fetcher, metrics: Optional[list[str]], services: Optional[set[str]]):
+        self.fetcher = fetcher
+        self.metrics = metrics
+        self.services = services
+
+    def metric_names(self) -> list[str]:
+        if self.metrics is None:
+            return self.fetcher.metric_names()
+        return [metric for metric in self.fetcher.metric_names() if metric in self.metrics]
+
+    def ready_fetch(self):
+        self.fetcher.ready_fetch()
+
+    def service_names(self) -> Optional[list[str]]:
+        names = self.fetcher.service_names()
+        if names is None or self.services is None:
+            return names
+        return [name for name in names if name in self.services]
+
+    def selected_services(self) -> Optional[set[str]]:
+        return self.services
+
+    def fetch_stats(self) -> tuple[int, float]:
+        return self.fetcher.fetch_stats()
+
+    def fetch(self, metric_name: str, services: Optional[set[str]] = None) -> Optional[FetchedData]:
+        if self.services is not None:
+            services = self.services if services is None else services & self.services
+        return self.fetcher.fetch(metric_name, services)
+
+
+def backfill_config(conf: PredictConfig) -> PredictConfig:
+    """
+    Calculate all selected services, regardless of the stored baseline and the query frequency.
+    """
+    overrides = {'recompute_interval': 0, 'refresh_horizon': 0, 'lazy_unqueried': False}
+    profiles = {name: profile.override(**overrides) for name, profile in conf.profiles.items()}
+    conf = conf.override(**overrides)
+    conf.profiles = profiles
+    return conf
+
+
+def print_summary(stats: PredictStats, seconds: float):
+    fetch_mb = stats.fetch_bytes / 1024 / 1024
+    print(f"calculated {stats.series} series in {seconds:.1f} seconds, {stats.series / max(seconds, 1e-6):.2f} series/s")
+    print(f"fetched {fetch_mb:.2f} MB in {stats.fetch_seconds:.1f} seconds of requests, "
+          f"{fetch_mb / max(stats.fetch_seconds, 1e-6):.2f} MB/s per request, {fetch_mb / max(seconds, 1e-6):.2f} MB/s overall")
+    if stats.fit_seconds:
+        p50, p99 = np.percentile(stats.fit_seconds, [50, 99])
+        print(f"fitted {len(stats.fit_seconds)} models, fit time p50: {p50:.3f}s, p99: {p99:.3f}s")
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Calculate the baseline of the selected metrics and services once, "
+                                                 "the interrupted run resumes from the completed units.")
+    parser.add_argument('--metrics', help="the metric names separated by comma, default all configured metrics")
+    parser.add_argument('--services', help="the service names separated by comma, default all services")
+    parser.add_argument('--shards', type=int, default=16,
+                        help="the number of checkpoint units of each metric split by the service name")
+    parser.add_argument('--workers', type=int, default=0, help="the number of worker processes, default the CPU count")
+    parser.add_argument('--checkpoint', help="the checkpoint directory, default the `backfill` in the predict directory")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and calculate all units again")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or os.path.join(current_config.baseline.predict.directory, 'backfill')
+    if args.restart and os.path.exists(checkpoint):
+        shutil.rmtree(checkpoint)
+    fetcher = SelectedFetcher(GraphQLFetcher(current_config.baseline.fetch),
+                              args.metrics.split(',') if args.metrics else None,
+                              set(args.services.split(',')) if args.services else None)
+    # the completed units are never expired, the lease TTL only affects the abandoned units of a crashed run
+    coordinator = Coordinator(FileLeaseManager(checkpoint, 0), args.shards, 60)
+    calculator = Calculator(backfill_config(build_predict_config(current_config.baseline)), fetcher,
+                            create_result_manager(current_config.baseline.predict.storage,
+                                                  current_config.baseline.predict.directory),
+                            worker=WorkerConfig(args.workers), coordinator=coordinator)
+
+    logger.info(f"Backfill the baseline of {fetcher.metric_names()}, checkpoint: {checkpoint}")
+    start = time.time()
+    try:
+        calculator.start(cycle=backfill_cycle)
+    finally:
+        calculator.close()
+    print_summary(calculator.stats, time.time() - start)
+
+    if all_completed(fetcher, coordinator):
+        # the next run starts from scratch
+        shutil.rmtree(checkpoint, ignore_errors=True)
+    else:
+        logger.warning(f"Not all units are completed, run again to resume from the checkpoint: {checkpoint}")
+
+
+def all_completed(fetcher: Fetcher, coordinator: Coordinator) -> bool:
+    for meter in fetcher.metric_names():
+        for unit in coordinator.units(meter, fetcher.service_names()):
+            if not coordinator.leases.is_completed(unit.name, backfill_cycle):
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    run()
@@ -21,10 +21,17 @@ import tempfile
 import baseline
 from prometheus_client import CollectorRegistry, multiprocess, start_http_server
 
+from baseline.access import AccessTracker
+from baseline.admin import AdminServer, RecomputeQueue
+from baseline.calculate import WorkerConfig
+from baseline.cluster import ClusterConfig
+from baseline.correct import CorrectionConfig
 from baseline.fetcher import GraphQLFetcher
-from baseline.predict import PredictConfig
+from baseline.lease import Coordinator, FileLeaseManager
+from baseline.predict import PredictConfig, PipelineConfig
 from baseline.query import Query
-from baseline.result import MeterNameResultManager
+from baseline.readiness import Readiness, ReadinessServer
+from baseline.result import CachedResultManager, create_result_manager
 from baseline.scheduler import Scheduler
 from baseline.config.config import current_config
 
@@ -57,22 +64,72 @@ def setup_prometheus(port):
 init_logger(current_config.logging)
 logger = logging.getLogger(__name__)
 
+# the query access stats of the services, kept in the predict directory across the restarts
+access_file = 'query_access.json'
+
+
+def build_predict_config(c: baseline.config.config.BaselineConfig) -> PredictConfig:
+    predict = c.predict
+    conf = PredictConfig(predict.min_days, predict.frequency, predict.period,
+                         ClusterConfig(predict.cluster.enabled, predict.cluster.distance, predict.cluster.max_error),
+                         predict.fit_timeout, predict.engine, predict.window_days, predict.interval_width,
+                         predict.recompute_interval, predict.refresh_horizon, predict.lazy_unqueried,
+                         predict.save_queue_size,
+                         PipelineConfig(predict.pipeline.enabled, predict.pipeline.fetch_concurrency,
+                                        predict.pipeline.fit_concurrency, predict.pipeline.queue_size),
+                         predict.hot_refresh_horizon)
+    for metric in c.fetch.metrics:
+        if metric.predict is not None:
+            conf.profiles[metric.name] = conf.override(**metric.predict.model_dump(exclude_none=True))
+    conf.validate()
+    return conf
+
 
 def run():
-    conf = PredictConfig(current_config.baseline.predict.min_days, current_config.baseline.predict.frequency,
-                         current_config.baseline.predict.period)
+    conf = build_predict_config(current_config.baseline)
     fetcher = GraphQLFetcher(current_config.baseline.fetch)
-    result_manager = MeterNameResultManager(current_config.baseline.predict.directory)
+    predict = current_config.baseline.predict
+    result_manager = create_result_manager(predict.storage, predict.directory)
+    # the columnar and sqlite results are queried by the service directly, decoding them into the cache is worthless
+    if predict.cache_size > 0 and predict.storage.lower() not in ('columnar', 'sqlite'):
+        result_manager = CachedResultManager(result_manager, predict.cache_size * 1024 * 1024)
+    if predict.save_queue_size > 0 and not result_manager.incremental_update:
+        logger.warning(f"the {predict.storage} storage rewrites the whole metric on each update, "
+                       "the save queue size is ignored, the results are saved after each metric calculated")
+
+    access_tracker = AccessTracker(predict.query_half_life * 60, os.path.join(predict.directory, access_file))
+
+    # the metrics directory must be ready before the calculation workers started
+    if current_config.server.monitor.enabled:
+        setup_prometheus(current_config.server.monitor.port)
 
-    scheduler = Scheduler(current_config.baseline.cron, conf, fetcher, result_manager)
+    correction = current_config.baseline.correction
+    worker = current_config.baseline.predict.worker
+    coordination = current_config.baseline.coordination
+    coordinator = None
+    if coordination.enabled:
+        coordinator = Coordinator(FileLeaseManager(coordination.directory, coordination.lease_ttl), coordination.shards,
+                                  coordination.lease_ttl / 3)
+    scheduler = Scheduler(current_config.baseline.cron, conf, fetcher, result_manager, access_tracker,
+                          CorrectionConfig(correction.interval, correction.lookback, correction.alpha,
+                                           correction.drift_threshold, correction.refit_cooldown),
+                          WorkerConfig(worker.max_workers, worker.max_tasks, worker.max_memory,
+                                       worker.memory_limit_ratio, worker.rss_growth_tasks), coordinator)
     scheduler.start()
 
-    if current_config.server.monitor.enabled:
-        setup_prometheus(current_config.server.monitor.port)
+    readiness = current_config.server.readiness
+    if readiness.enabled:
+        ReadinessServer(readiness.port, Readiness(result_manager, fetcher.metric_names(), scheduler.calculator,
+                                                  readiness.max_age)).start()
+
+    admin = current_config.server.admin
+    if admin.enabled:
+        AdminServer(admin.port, RecomputeQueue(scheduler.calculator)).start()
 
     loop = asyncio.get_event_loop()
     try:
-        query = Query(current_config.server.grpc.port, fetcher, result_manager)
+        query = Query(current_config.server.grpc.port, fetcher, result_manager, access_tracker,
+                      current_config.server.grpc.prediction_cache_size, current_config.server.grpc.query_concurrency)
         sys.exit(loop.run_until_complete(query.serve()))
     except KeyboardInterrupt:
         logger.info("attempting graceful shutdown, press Ctrl+C again to exit…")
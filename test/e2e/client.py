@@ -15,6 +15,7 @@
 Run this file to get a web demo of the URI Drain algorithm.
 """
 import datetime
+import os
 import sys
 
 import google
@@ -28,7 +29,8 @@ from google.protobuf.json_format import MessageToDict
 
 mode = sys.argv[1]
 
-channel = grpc.insecure_channel('localhost:18080')
+# the predictor of each result storage listens on its own port
+channel = grpc.insecure_channel(os.environ.get('PREDICT_ADDRESS', 'localhost:18080'))
 stub = AlarmBaselineServiceStub(channel)
 
 
@@ -0,0 +1,53 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import tempfile
+import time
+import unittest
+
+from baseline.access import AccessTracker
+
+
+class AccessTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.join(tempfile.mkdtemp(), 'access.json')
+        self.tracker = AccessTracker(3600, self.file_name)
+
+    def test_saved_and_loaded(self):
+        self.tracker.record('svc', ['service_cpm', 'service_sla'])
+        self.tracker.record('svc', ['service_cpm'])
+        self.tracker.save()
+
+        scores = AccessTracker(3600, self.file_name).service_scores('service_cpm')
+        self.assertAlmostEqual(scores['svc'], 2, places=3)
+
+    def test_stale_stats_pruned_when_saving(self):
+        self.tracker.record('svc-a', ['service_cpm', 'service_sla'])
+        self.tracker.record('svc-b', ['service_cpm'])
+        # not queried for ten half-lives
+        self.tracker.stats['service_sla']['svc-a'].last_access = time.time() - 3600 * 10
+        self.tracker.stats['service_cpm']['svc-b'].last_access = time.time() - 3600 * 10
+        self.tracker.save()
+
+        self.assertEqual(list(self.tracker.stats), ['service_cpm'])
+        self.assertEqual(list(self.tracker.service_scores('service_cpm')), ['svc-a'])
+        loaded = AccessTracker(3600, self.file_name)
+        self.assertEqual(loaded.metric_scores().keys(), {'service_cpm'})
+        self.assertEqual(list(loaded.service_scores('service_cpm')), ['svc-a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import itertools
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from baseline.cluster import ClusterConfig, build_clusters
+
+hours = pd.date_range('2025-01-01 00:00', periods=48, freq='h')
+
+
+def daily(amplitude: float, scale: float = 1) -> pd.DataFrame:
+    return pd.DataFrame({'ds': hours, 'y': scale * (1 + amplitude * np.sin(2 * np.pi * hours.hour / 24))})
+
+
+class BuildClustersTest(unittest.TestCase):
+
+    def test_clusters_independent_of_input_order(self):
+        # b is close to both a and c, but a and c are too far to share a cluster
+        series = {'a': daily(0), 'b': daily(0.08, 10), 'c': daily(0.16, 100), 'zero': daily(0, 0)}
+
+        for keys in itertools.permutations(series):
+            clusters, standalone = build_clusters({key: series[key] for key in keys}, ClusterConfig(distance=0.1))
+            self.assertEqual([[member.key for member in cluster.members] for cluster in clusters], [['a', 'b'], ['c']])
+            self.assertEqual(standalone, ['zero'])
+
+    def test_sort_key(self):
+        series = {('svc-a', 1): daily(0.08), ('svc-b', 0): daily(0)}
+
+        clusters, _ = build_clusters(series, ClusterConfig(distance=0.1), lambda key: key[1])
+
+        self.assertEqual([member.key for member in clusters[0].members], [('svc-b', 0), ('svc-a', 1)])
+
+    def test_member_band_widened_by_error(self):
+        series = {'a': daily(0.2, 10), 'b': daily(0.16, 20)}
+        clusters, _ = build_clusters(series, ClusterConfig(distance=0.1))
+        cluster = clusters[0]
+        training = cluster.training_df()
+        forecast = pd.DataFrame({'ds': training['ds'], 'yhat': training['y'],
+                                 'yhat_lower': training['y'] - 0.05, 'yhat_upper': training['y'] + 0.05})
+
+        member = cluster.members[1]
+        error = cluster.member_error(member, forecast)
+        self.assertGreater(error, 0)
+        scaled = cluster.member_forecast(member, forecast, error)
+
+        last = forecast.iloc[-1]
+        self.assertAlmostEqual(scaled['yhat'].iloc[-1], last['yhat'] * member.scale)
+        self.assertAlmostEqual(scaled['yhat_lower'].iloc[-1], (last['yhat'] - 0.05 - error) * member.scale)
+        self.assertAlmostEqual(scaled['yhat_upper'].iloc[-1], (last['yhat'] + 0.05 + error) * member.scale)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from baseline import columnar
+from baseline.columnar import ColumnarResultManager
+from baseline.fetcher import LabelKeyValue
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictValue, \
+    PredictLabeledWithLabeledValue
+from baseline.result import QueryTimeBucketStep
+
+hours = pd.date_range('2025-01-01 00:00', periods=6, freq='h')
+p50 = frozenset([LabelKeyValue('p', '50')])
+p99 = frozenset([LabelKeyValue('p', '99')])
+
+
+def points(base: float) -> list[PredictTimestampWithSingleValue]:
+    return [PredictTimestampWithSingleValue(ts, PredictValue(base + i, base + i + 1, base + i - 1))
+            for i, ts in enumerate(hours)]
+
+
+def query(manager: ColumnarResultManager, service: str, start: int, end: int) -> dict[str, list[PredictMeterResult]]:
+    return manager.query(service, ['service_cpm'], start, end, QueryTimeBucketStep.HOUR)
+
+
+class ColumnarResultManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.manager = ColumnarResultManager(self.dir)
+        self.manager.save('service_cpm', [
+            PredictMeterResult('single', single=points(10)),
+            PredictMeterResult('labeled', labeled=[PredictLabeledWithLabeledValue(p99, points(200)),
+                                                   PredictLabeledWithLabeledValue(p50, points(100))]),
+            PredictMeterResult('empty', labeled=[]),
+        ])
+
+    def test_query_single_in_bucket_range(self):
+        result = query(self.manager, 'single', 2025010101, 2025010103)['service_cpm'][0]
+
+        self.assertIsNone(result.labeled)
+        self.assertEqual([point.time_bucket for point in result.single], [2025010101, 2025010102, 2025010103])
+        self.assertEqual([point.timestamp for point in result.single], list(hours[1:4]))
+        self.assertEqual([(point.value.value, point.value.upper_value, point.value.lower_value)
+                          for point in result.single], [(11, 12, 10), (12, 13, 11), (13, 14, 12)])
+
+    def test_query_labeled_in_bucket_range(self):
+        result = query(self.manager, 'labeled', 2025010104, 2025010200)['service_cpm'][0]
+
+        self.assertIsNone(result.single)
+        labeled = {entry.label: [point.value.value for point in entry.time_with_values] for entry in result.labeled}
+        self.assertEqual(labeled, {p50: [104, 105], p99: [204, 205]})
+
+    def test_query_out_of_range_and_unknown_service(self):
+        result = query(self.manager, 'single', 2025010200, 2025010210)['service_cpm'][0]
+        self.assertEqual(result.single, [])
+        self.assertEqual(query(self.manager, 'unknown', 2025010100, 2025010105), {})
+        self.assertEqual(self.manager.query('single', ['service_percentile'], 2025010100, 2025010105,
+                                            QueryTimeBucketStep.HOUR), {})
+
+    def test_load_all_services(self):
+        results = {result.service_name: result for result in self.manager.load('service_cpm')}
+
+        self.assertEqual(set(results), {'single', 'labeled', 'empty'})
+        self.assertEqual(results['single'].points(), len(hours))
+        self.assertEqual(results['labeled'].points(), len(hours) * 2)
+        self.assertEqual(results['empty'].labeled, [])
+        self.assertIsNone(results['empty'].single)
+
+    def test_save_switches_generation(self):
+        mapped = self.manager.generation('service_cpm')
+        with mock.patch.object(columnar, 'generation_grace_seconds', 0):
+            self.manager.save('service_cpm', [PredictMeterResult('single', single=points(50))])
+
+        result = query(ColumnarResultManager(self.dir), 'single', 2025010100, 2025010100)['service_cpm'][0]
+        self.assertEqual(result.single[0].value.value, 50)
+        result = query(self.manager, 'single', 2025010100, 2025010100)['service_cpm'][0]
+        self.assertEqual(result.single[0].value.value, 50)
+        # the mapped old generation is still readable after its file removed
+        self.assertEqual(mapped.result('single').single[0].value.value, 10)
+        self.assertEqual(len([name for name in os.listdir(self.dir) if name.endswith('.bin')]), 1)
+
+    def test_unsupported_file_ignored(self):
+        with open(self.manager.pointer_file('service_cpm'), 'r', encoding='utf-8') as f:
+            generation = f.read().strip()
+        with open(f"{self.dir}/{generation}", 'r+b') as f:
+            f.write(b'XXXX')
+
+        self.assertEqual(ColumnarResultManager(self.dir).load('service_cpm'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import tempfile
+import unittest
+from concurrent.futures import Future
+from typing import Optional
+
+import pandas as pd
+
+from baseline.correct import CorrectionConfig, Corrector
+from baseline.fetcher import Fetcher, FetchedData, FetchedSingleDataConfig
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictValue
+from baseline.result import MeterNameResultManager
+
+time_format = '%Y%m%d%H'
+
+
+class RecentFetcher(Fetcher):
+    def __init__(self, observed: dict[pd.Timestamp, float]):
+        self.observed = observed
+
+    def metric_names(self) -> list[str]:
+        return ['service_cpm']
+
+    def fetch(self, metric_name: str, services: Optional[set[str]] = None) -> Optional[FetchedData]:
+        df = pd.DataFrame({
+            'service': ['svc'] * len(self.observed),
+            'time': [ts.strftime(time_format) for ts in self.observed],
+            'value': list(self.observed.values()),
+        })
+        return FetchedData(df, FetchedSingleDataConfig('service', 'time', 'value', time_format), None)
+
+
+class RecordingCalculator:
+    def __init__(self, fetcher: Fetcher, saver: MeterNameResultManager):
+        self.fetcher = fetcher
+        self.saver = saver
+        self.recomputed: list[set[str]] = []
+        self.futures: list[Future] = []
+
+    def recompute(self, meter: str, services: set[str]) -> Future:
+        self.recomputed.append(services)
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+class CorrectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hours = pd.date_range('2025-01-01 00:00', periods=8, freq='h')
+        self.saver = MeterNameResultManager(tempfile.mkdtemp())
+        self.saver.save('service_cpm', [PredictMeterResult('svc', single=[
+            PredictTimestampWithSingleValue(ts, PredictValue(100.0, 120.0, 80.0)) for ts in self.hours])])
+
+    def corrector(self, observed: dict[pd.Timestamp, float], drift_threshold: float = 0,
+                  refit_cooldown: int = 60) -> Corrector:
+        calculator = RecordingCalculator(RecentFetcher(observed), self.saver)
+        return Corrector(calculator, CorrectionConfig(interval=1, lookback=3, alpha=0.5,
+                                                      drift_threshold=drift_threshold, refit_cooldown=refit_cooldown))
+
+    def stored_values(self) -> list[float]:
+        return [point.value.value for point in self.saver.load('service_cpm')[0].single]
+
+    def test_level_added_from_first_observed(self):
+        self.corrector({self.hours[1]: 110.0, self.hours[2]: 110.0}).correct('service_cpm')
+        values = self.stored_values()
+        self.assertEqual(values[0], 100.0)
+        for value in values[1:]:
+            self.assertAlmostEqual(value, 110.0)
+
+    def test_correct_same_data_twice_unchanged(self):
+        corrector = self.corrector({self.hours[0]: 104.0, self.hours[1]: 112.0, self.hours[2]: 109.0})
+        corrector.correct('service_cpm')
+        corrected = self.stored_values()
+        self.assertNotEqual(corrected[-1], 100.0)
+
+        corrector.correct('service_cpm')
+        self.assertEqual(self.stored_values(), corrected)
+
+    def test_drifted_service_recomputed(self):
+        corrector = self.corrector({self.hours[0]: 500.0, self.hours[1]: 500.0}, drift_threshold=0.5)
+        corrector.correct('service_cpm')
+        self.assertEqual(corrector.calculator.recomputed, [{'svc'}])
+        self.assertEqual(self.stored_values(), [100.0] * len(self.hours))
+
+    def test_drifted_service_not_queued_while_refitting(self):
+        corrector = self.corrector({self.hours[0]: 500.0, self.hours[1]: 500.0}, drift_threshold=0.5)
+        corrector.correct('service_cpm')
+        corrector.correct('service_cpm')
+        self.assertEqual(corrector.calculator.recomputed, [{'svc'}])
+
+        # still drifting after the recompute, but in the cooldown
+        corrector.calculator.futures[0].set_result(None)
+        corrector.correct('service_cpm')
+        self.assertEqual(corrector.calculator.recomputed, [{'svc'}])
+
+    def test_drifted_service_queued_after_cooldown(self):
+        corrector = self.corrector({self.hours[0]: 500.0, self.hours[1]: 500.0}, drift_threshold=0.5,
+                                   refit_cooldown=0)
+        corrector.correct('service_cpm')
+        corrector.calculator.futures[0].set_result(None)
+        corrector.correct('service_cpm')
+        self.assertEqual(corrector.calculator.recomputed, [{'svc'}, {'svc'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import tempfile
+import time
+import unittest
+
+from baseline.lease import Coordinator, FileLeaseManager
+
+
+class FileLeaseManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.a = FileLeaseManager(self.dir, 60, owner='a')
+        self.b = FileLeaseManager(self.dir, 60, owner='b')
+
+    def test_held_lease_not_acquired(self):
+        self.assertTrue(self.a.acquire('service_cpm.0', '1'))
+        self.assertFalse(self.b.acquire('service_cpm.0', '1'))
+        self.assertFalse(self.b.renew('service_cpm.0'))
+        # another unit is not affected
+        self.assertTrue(self.b.acquire('service_cpm.1', '1'))
+
+    def test_expired_lease_taken_over(self):
+        a = FileLeaseManager(self.dir, 0.05, owner='a')
+        self.assertTrue(a.acquire('service_cpm.0', '1'))
+        time.sleep(0.1)
+
+        self.assertTrue(self.b.acquire('service_cpm.0', '1'))
+        # the previous owner lost the lease
+        self.assertFalse(a.renew('service_cpm.0'))
+        self.assertFalse(a.acquire('service_cpm.0', '1'))
+        self.assertTrue(self.b.renew('service_cpm.0'))
+
+    def test_released_lease_acquired(self):
+        self.assertTrue(self.a.acquire('service_cpm.0', '1'))
+        self.b.release('service_cpm.0')
+        self.assertFalse(self.b.acquire('service_cpm.0', '1'))
+
+        self.a.release('service_cpm.0')
+        self.assertTrue(self.b.acquire('service_cpm.0', '1'))
+
+    def test_completed_in_cycle(self):
+        self.assertTrue(self.a.acquire('service_cpm.0', '1'))
+        self.a.complete('service_cpm.0', '1')
+
+        self.assertTrue(self.b.is_completed('service_cpm.0', '1'))
+        self.assertFalse(self.a.acquire('service_cpm.0', '1'))
+        self.assertFalse(self.b.acquire('service_cpm.0', '1'))
+        # acquired again in the next cycle
+        self.assertFalse(self.b.is_completed('service_cpm.0', '2'))
+        self.assertTrue(self.b.acquire('service_cpm.0', '2'))
+
+    def test_broken_lease_treated_as_expired(self):
+        self.assertTrue(self.a.acquire('service_cpm.0', '1'))
+        with open(f"{self.dir}/service_cpm.0.lease", 'w', encoding='utf-8') as f:
+            f.write('{')
+
+        self.assertTrue(self.b.acquire('service_cpm.0', '1'))
+
+
+class CoordinatorTest(unittest.TestCase):
+
+    def test_units_partition_services(self):
+        coordinator = Coordinator(FileLeaseManager(tempfile.mkdtemp(), 60), 4, 10)
+        services = [f"svc-{i}" for i in range(100)]
+
+        units = coordinator.units('service_cpm', services)
+
+        self.assertEqual([unit.name for unit in units], [f"service_cpm.{shard}" for shard in range(4)])
+        self.assertEqual(sorted(service for unit in units for service in unit.services), sorted(services))
+        for unit in units:
+            for service in services:
+                self.assertEqual(service in unit, service in unit.services)
+        # a new service belongs to exactly one unit
+        self.assertEqual(sum('svc-new' in unit for unit in units), 1)
+
+    def test_unknown_services_single_unit(self):
+        coordinator = Coordinator(FileLeaseManager(tempfile.mkdtemp(), 60), 4, 10)
+
+        units = coordinator.units('service_cpm', None)
+
+        self.assertEqual([unit.name for unit in units], ['service_cpm.0'])
+        self.assertIn('svc', units[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
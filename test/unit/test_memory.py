@@ -0,0 +1,104 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from typing import Optional
+from unittest import mock
+
+from baseline import memory
+from baseline.memory import MemoryGovernor, read_memory_file
+
+
+class MemoryGovernorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.usage = 50
+        patches = [mock.patch.object(memory, 'memory_limit', lambda: 100),
+                   mock.patch.object(memory, 'memory_usage', lambda: self.usage)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.governor = MemoryGovernor(0.8, poll_interval=0.01)
+
+    def admit_in_thread(self, deadline: Optional[float] = None) -> threading.Event:
+        admitted = threading.Event()
+
+        def run():
+            with self.governor.admit('svc', deadline):
+                admitted.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return admitted
+
+    def test_admitted_with_headroom(self):
+        with self.governor.admit('svc-a'):
+            self.assertTrue(self.admit_in_thread().wait(1))
+        self.assertEqual(self.governor.running, 0)
+
+    def test_first_task_admitted_without_headroom(self):
+        self.usage = 90
+        with self.governor.admit('svc-a'):
+            self.assertEqual(self.governor.running, 1)
+
+    def test_waits_until_running_task_finished(self):
+        self.usage = 90
+        with self.governor.admit('svc-a'):
+            admitted = self.admit_in_thread()
+            self.assertFalse(admitted.wait(0.1))
+        self.assertTrue(admitted.wait(1))
+
+    def test_waits_until_memory_released(self):
+        self.usage = 90
+        with self.governor.admit('svc-a'):
+            admitted = self.admit_in_thread()
+            self.assertFalse(admitted.wait(0.1))
+            self.usage = 50
+            self.assertTrue(admitted.wait(1))
+
+    def test_admitted_after_deadline(self):
+        self.usage = 90
+        with self.governor.admit('svc-a'):
+            self.assertTrue(self.admit_in_thread(time.time() + 0.05).wait(1))
+
+    def test_unknown_memory_has_headroom(self):
+        with mock.patch.object(memory, 'memory_limit', lambda: None):
+            self.usage = 1000
+            self.assertTrue(self.governor.has_headroom())
+
+
+class ReadMemoryFileTest(unittest.TestCase):
+
+    def read(self, *contents: str):
+        dir = tempfile.mkdtemp()
+        files = []
+        for i, content in enumerate(contents):
+            files.append(os.path.join(dir, str(i)))
+            with open(files[-1], 'w') as f:
+                f.write(content)
+        return read_memory_file([os.path.join(dir, 'missing')] + files)
+
+    def test_read_limit(self):
+        self.assertEqual(self.read('1073741824\n'), 1073741824)
+        self.assertEqual(self.read('invalid', '1024'), 1024)
+        self.assertIsNone(self.read('max\n'))
+        self.assertIsNone(self.read(str(memory.unlimited_memory)))
+        self.assertIsNone(self.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
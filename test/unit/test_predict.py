@@ -0,0 +1,107 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+from typing import Optional
+
+import pandas as pd
+
+from baseline.fetcher import Fetcher, FetchedData, FetchedMultipleDataConfig, FetchedMultipleValueColumnConfig, \
+    FetchedSingleDataConfig, LabelKeyValue
+from baseline.predict import PredictConfig, PredictService
+
+time_format = '%Y-%m-%d %H:%M'
+
+
+class NoFetcher(Fetcher):
+    def metric_names(self) -> list[str]:
+        return []
+
+    def fetch(self, metric_name: str, services: Optional[set[str]] = None) -> Optional[FetchedData]:
+        return None
+
+
+def hours(count: int) -> list[str]:
+    return [ts.strftime(time_format) for ts in pd.date_range('2025-01-01 00:00', periods=count, freq='h')]
+
+
+class SplitToMeterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = PredictService(NoFetcher(), 'service_percentile', PredictConfig(1, 'h', 24, engine='seasonal'))
+
+    def test_multiple_drops_rows_without_timestamp(self):
+        # the first row of each fetch has no timestamp
+        times = [None] + hours(24)
+        df = pd.DataFrame({
+            'svc': ['svc'] * len(times),
+            'ts': times,
+            'label_0': [1.0] * len(times),
+            'label_1': [2.0] * (len(times) - 1) + [None],
+        })
+        p50, p99 = [LabelKeyValue('p', '50')], [LabelKeyValue('p', '99')]
+        data = FetchedData(df, None, FetchedMultipleDataConfig('svc', 'ts', [
+            FetchedMultipleValueColumnConfig(p50, 'label_0'), FetchedMultipleValueColumnConfig(p99, 'label_1')],
+                                                               time_format))
+
+        meters = list(self.service.split_to_meter(data))
+
+        self.assertEqual(len(meters), 1)
+        label_dfs = meters[0].label_dfs
+        # the timestamped rows of p50 are enough, p99 misses the last value
+        self.assertEqual(list(label_dfs), [frozenset(p50)])
+        self.assertEqual(len(label_dfs[frozenset(p50)]), 24)
+        self.assertFalse(label_dfs[frozenset(p50)]['ds'].isna().any())
+
+    def test_multiple_drops_missing_values(self):
+        times = hours(26)
+        df = pd.DataFrame({
+            'svc': ['svc'] * len(times),
+            'ts': times,
+            'label_0': [1.0, None] + [1.0] * (len(times) - 2),
+        })
+        p50 = [LabelKeyValue('p', '50')]
+        data = FetchedData(df, None, FetchedMultipleDataConfig('svc', 'ts', [
+            FetchedMultipleValueColumnConfig(p50, 'label_0')], time_format))
+
+        label_df = list(self.service.split_to_meter(data))[0].label_dfs[frozenset(p50)]
+
+        self.assertEqual(len(label_df), 25)
+        self.assertFalse(label_df['y'].isna().any())
+
+    def test_single_drops_rows_without_timestamp(self):
+        times = [None] + hours(24)
+        df = pd.DataFrame({'svc': ['svc'] * len(times), 'ts': times, 'value': [1.0] * len(times)})
+        data = FetchedData(df, FetchedSingleDataConfig('svc', 'ts', 'value', time_format), None)
+
+        meters = list(self.service.split_to_meter(data))
+
+        self.assertEqual(len(meters[0].single_df), 24)
+        self.assertFalse(meters[0].single_df['ds'].isna().any())
+
+
+class PredictConfigTest(unittest.TestCase):
+
+    def test_validate_unknown_profile_engine(self):
+        conf = PredictConfig(1, 'h', 24)
+        conf.profiles['service_cpm'] = conf.override(engine='seasonal')
+        conf.validate()
+
+        conf.profiles['service_percentile'] = conf.override(engine='arima')
+        with self.assertRaisesRegex(ValueError, 'service_percentile'):
+            conf.validate()
+
+
+if __name__ == '__main__':
+    unittest.main()
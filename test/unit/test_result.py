@@ -0,0 +1,119 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+from typing import Optional
+
+import pandas as pd
+
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictValue
+from baseline.result import CachedResultManager, QueryTimeBucketStep, ResultManager, result_point_bytes
+
+hours = pd.date_range('2025-01-01 00:00', periods=4, freq='h')
+
+
+def result(service: str, value: float) -> PredictMeterResult:
+    return PredictMeterResult(service, single=[PredictTimestampWithSingleValue(ts, PredictValue(value, value, value))
+                                               for ts in hours])
+
+
+class MemoryResultManager(ResultManager):
+    """
+    Keep the results in memory, the updated time is only changed by the test.
+    """
+
+    def __init__(self):
+        self.results: dict[str, list[PredictMeterResult]] = {}
+        self.updated: dict[str, float] = {}
+        self.loaded: list[str] = []
+
+    def save(self, meter_name: str, results: list[PredictMeterResult]):
+        self.results[meter_name] = results
+        self.updated[meter_name] = self.updated.get(meter_name, 0) + 1
+
+    def query(self, service_name: str, metrics_names: list[str], start_bucket: int, end_bucket: int,
+              step: QueryTimeBucketStep) -> dict[str, list[PredictMeterResult]]:
+        raise NotImplementedError
+
+    def load(self, meter_name: str) -> list[PredictMeterResult]:
+        self.loaded.append(meter_name)
+        return self.results.get(meter_name, [])
+
+    def updated_time(self, meter_name: str) -> Optional[float]:
+        return self.updated.get(meter_name)
+
+
+class CachedResultManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.delegate = MemoryResultManager()
+        self.delegate.save('service_cpm', [result('svc', 1)])
+        self.delegate.save('service_sla', [result('svc', 2)])
+        self.delegate.save('service_resp_time', [result('svc', 3)])
+        # room for the results of two metrics
+        self.manager = CachedResultManager(self.delegate, len(hours) * result_point_bytes * 2)
+
+    def value(self, meter_name: str) -> float:
+        results = self.manager.query('svc', [meter_name], 2025010100, 2025010101, QueryTimeBucketStep.HOUR)
+        return results[meter_name][0].single[0].value.value
+
+    def test_query_cached(self):
+        self.assertEqual(self.value('service_cpm'), 1)
+        self.assertEqual(self.value('service_cpm'), 1)
+        self.assertEqual(self.delegate.loaded, ['service_cpm'])
+
+        results = self.manager.query('svc', ['service_cpm'], 2025010101, 2025010102, QueryTimeBucketStep.HOUR)
+        self.assertEqual([point.time_bucket for point in results['service_cpm'][0].single], [2025010101, 2025010102])
+        self.assertEqual(self.manager.query('unknown', ['service_cpm'], 2025010100, 2025010101,
+                                            QueryTimeBucketStep.HOUR), {})
+
+    def test_invalidated_by_updated_time(self):
+        self.assertEqual(self.value('service_cpm'), 1)
+        # saved by another process, only the updated time tells the change
+        self.delegate.save('service_cpm', [result('svc', 10)])
+
+        self.assertEqual(self.value('service_cpm'), 10)
+        self.assertEqual(self.delegate.loaded, ['service_cpm', 'service_cpm'])
+
+    def test_invalidated_by_save(self):
+        self.assertEqual(self.value('service_cpm'), 1)
+        self.manager.save('service_cpm', [result('svc', 10)])
+
+        self.assertNotIn('service_cpm', self.manager.entries)
+        self.assertEqual(self.value('service_cpm'), 10)
+
+    def test_least_recently_used_evicted(self):
+        self.value('service_cpm')
+        self.value('service_sla')
+        self.value('service_cpm')
+        self.value('service_resp_time')
+
+        self.assertEqual(list(self.manager.entries), ['service_cpm', 'service_resp_time'])
+        self.assertEqual(self.manager.size, len(hours) * result_point_bytes * 2)
+
+        self.value('service_sla')
+        self.assertEqual(self.delegate.loaded, ['service_cpm', 'service_sla', 'service_resp_time', 'service_sla'])
+
+    def test_too_large_not_cached(self):
+        self.delegate.save('service_percentile', [result('svc', 4), result('svc-b', 4), result('svc-c', 4)])
+
+        self.assertEqual(self.value('service_percentile'), 4)
+        self.assertEqual(self.value('service_percentile'), 4)
+        self.assertNotIn('service_percentile', self.manager.entries)
+        self.assertEqual(self.manager.size, 0)
+        self.assertEqual(self.delegate.loaded, ['service_percentile', 'service_percentile'])
+
+
+if __name__ == '__main__':
+    unittest.main()
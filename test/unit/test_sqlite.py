@@ -0,0 +1,95 @@
+#  Copyright 2025 SkyAPM org
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import tempfile
+import unittest
+
+import pandas as pd
+
+from baseline.fetcher import LabelKeyValue
+from baseline.predict import PredictMeterResult, PredictTimestampWithSingleValue, PredictValue, \
+    PredictLabeledWithLabeledValue
+from baseline.result import QueryTimeBucketStep
+from baseline.sqlite import SQLiteResultManager
+
+hours = pd.date_range('2025-01-01 00:00', periods=6, freq='h')
+p50 = frozenset([LabelKeyValue('p', '50')])
+p99 = frozenset([LabelKeyValue('p', '99')])
+
+
+def points(base: float) -> list[PredictTimestampWithSingleValue]:
+    return [PredictTimestampWithSingleValue(ts, PredictValue(base + i, base + i + 1, base + i - 1))
+            for i, ts in enumerate(hours)]
+
+
+class SQLiteResultManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = SQLiteResultManager(tempfile.mkdtemp())
+        self.manager.save('service_cpm', [
+            PredictMeterResult('svc-a', single=points(10)),
+            PredictMeterResult('svc-b', labeled=[PredictLabeledWithLabeledValue(p50, points(100)),
+                                                 PredictLabeledWithLabeledValue(p99, points(200))]),
+        ])
+
+    def query(self, service: str, start: int, end: int) -> list[PredictMeterResult]:
+        return self.manager.query(service, ['service_cpm'], start, end, QueryTimeBucketStep.HOUR).get('service_cpm')
+
+    def values(self, service: str) -> list[float]:
+        return [point.value.value for point in self.query(service, 2025010100, 2025010123)[0].single]
+
+    def test_query_in_bucket_range(self):
+        single = self.query('svc-a', 2025010102, 2025010104)[0]
+        self.assertIsNone(single.labeled)
+        self.assertEqual([point.time_bucket for point in single.single], [2025010102, 2025010103, 2025010104])
+        self.assertEqual([(point.value.value, point.value.upper_value, point.value.lower_value)
+                          for point in single.single], [(12, 13, 11), (13, 14, 12), (14, 15, 13)])
+        self.assertEqual([point.timestamp for point in single.single], list(hours[2:5]))
+
+        labeled = self.query('svc-b', 2025010105, 2025010110)[0]
+        self.assertIsNone(labeled.single)
+        self.assertEqual({entry.label: [point.value.value for point in entry.time_with_values]
+                          for entry in labeled.labeled}, {p50: [105], p99: [205]})
+
+        self.assertEqual(self.query('svc-a', 2025010200, 2025010210)[0].single, [])
+        self.assertIsNone(self.query('svc-c', 2025010100, 2025010105))
+
+    def test_update_upserts_services(self):
+        self.manager.update('service_cpm', [PredictMeterResult('svc-a', single=points(50)[:2]),
+                                            PredictMeterResult('svc-c', single=points(70))])
+
+        # the rows of the updated service are replaced, not merged
+        self.assertEqual(self.values('svc-a'), [50, 51])
+        self.assertEqual(self.values('svc-c'), [70, 71, 72, 73, 74, 75])
+        self.assertEqual([result.service_name for result in self.manager.load('service_cpm')],
+                         ['svc-a', 'svc-b', 'svc-c'])
+
+    def test_update_removes_not_retained_services(self):
+        self.manager.update('service_cpm', [PredictMeterResult('svc-c', single=points(70))],
+                            retain={'svc-a'}, scope={'svc-a', 'svc-b', 'svc-c'})
+        self.assertEqual([result.service_name for result in self.manager.load('service_cpm')], ['svc-a', 'svc-c'])
+
+        # the services out of the scope are kept
+        self.manager.update('service_cpm', [], retain=set(), scope={'svc-c'})
+        self.assertEqual([result.service_name for result in self.manager.load('service_cpm')], ['svc-a'])
+
+    def test_update_changes_updated_time(self):
+        self.assertIsNone(self.manager.updated_time('service_percentile'))
+        updated = self.manager.updated_time('service_cpm')
+        self.manager.update('service_cpm', [PredictMeterResult('svc-a', single=points(50))])
+        self.assertGreaterEqual(self.manager.updated_time('service_cpm'), updated)
+
+
+if __name__ == '__main__':
+    unittest.main()